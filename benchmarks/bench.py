@@ -0,0 +1,295 @@
+# SPDX-FileCopyrightText: 2023 osfanbuff63
+#
+# SPDX-License-Identifier: Apache-2.0
+"""Benchmarks for the database and embed hot paths.
+
+Every run generates a synthetic `database.toml` and archive tree per size in a
+temporary folder, so nothing needs Discord or an existing database. For each
+operation it reports the latency, the bytes written to files and the peak
+memory allocated. Run it from the repository root:
+
+    python -m benchmarks.bench --users 10 1000 10000 --save baseline.json
+
+and compare a later run against that baseline with `--compare baseline.json`.
+"""
+
+import argparse
+import json
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import arrow
+
+from pkw_tracking_bot import archive
+from pkw_tracking_bot.archive import archive_path
+from pkw_tracking_bot.database import Database
+from pkw_tracking_bot.embeds import PAGE_SIZE, leaderboard_embed, stats_embed
+from pkw_tracking_bot.records import COURSES, Records
+from pkw_tracking_bot.times import CourseTime, leaderboard_month, next_reset
+
+SIZES = (10, 1_000, 10_000, 100_000)
+# the generated database is this month's, so writing to it doesn't roll it over
+_current = arrow.get(*leaderboard_month(), 15)
+# archived months generated next to each database, the two before the current one
+ARCHIVED_MONTHS = tuple(
+    (date.year, date.month)
+    for date in (_current.shift(months=-2), _current.shift(months=-1))
+)
+
+
+@dataclass
+class User:
+    """Stands in for `discord.User`, the benchmarked code only reads the ID."""
+
+    id: int
+
+
+@dataclass
+class Result:
+    """The measurements of one operation."""
+
+    name: str
+    runs: int
+    p50_ms: float
+    max_ms: float
+    bytes_written: Optional[int]
+    peak_kib: float
+
+
+def generate(folder: Path, users: int, seed: int = 0) -> tuple[Path, list[int]]:
+    """Write a synthetic month and its archives.
+
+    About two thirds of the users have a time on each course, like a busy month.
+
+    Args:
+        folder (Path): The folder to write `database.toml` and `database_archive` to.
+        users (int): The number of registered users.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        tuple[Path, list[int]]: The database file and the registered user IDs.
+    """
+    rng = random.Random(seed)
+    records = Records()
+    records.last_updated = arrow.utcnow().int_timestamp
+    user_ids = rng.sample(range(10**17, 10**18), users)
+    records.add_users(user_ids)
+    for user in user_ids:
+        for course in COURSES:
+            if rng.random() < 2 / 3:
+                records.set(
+                    user,
+                    course,
+                    CourseTime(rng.randint(3_000, 30_000)),
+                    rng.random() < 0.2,
+                )
+    text = records.dumps()
+    file = folder / "database.toml"
+    file.write_text(text)
+    for year, month in ARCHIVED_MONTHS:
+        month_file = archive_path(year, month, folder)
+        month_file.parent.mkdir(parents=True)
+        month_file.write_text(text)
+    return file, user_ids
+
+
+def _written() -> Optional[int]:
+    """The bytes this process has passed to `write` so far, where the OS reports it."""
+    try:
+        with open("/proc/self/io") as io:
+            for line in io:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def measure(
+    name: str,
+    operation: Callable[[Any], Any],
+    runs: int,
+    setup: Optional[Callable[[], Any]] = None,
+) -> Result:
+    """Time an operation, then run it once more to trace its peak memory.
+
+    Args:
+        name (str): The name to report.
+        operation (Callable[[Any], Any]): The operation, called with what `setup` returned.
+        runs (int): The number of timed runs.
+        setup (Callable[[], Any], optional): Prepares each run, untimed. Defaults to None.
+
+    Returns:
+        Result: The measurements.
+    """
+    timings = []
+    written = 0
+    for _ in range(runs):
+        state = setup() if setup is not None else None
+        before = _written()
+        started = time.perf_counter()
+        operation(state)
+        timings.append(time.perf_counter() - started)
+        after = _written()
+        if before is not None and after is not None:
+            written += after - before
+    state = setup() if setup is not None else None
+    tracemalloc.start()
+    try:
+        operation(state)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return Result(
+        name=name,
+        runs=runs,
+        p50_ms=statistics.median(timings) * 1000,
+        max_ms=max(timings) * 1000,
+        bytes_written=written // runs if _written() is not None else None,
+        peak_kib=peak / 1024,
+    )
+
+
+def run_size(users: int, runs: int) -> list[Result]:
+    """Benchmark every operation on a month of `users` registered users.
+
+    Args:
+        users (int): The number of registered users.
+        runs (int): The number of timed runs of the cheap operations.
+
+    Returns:
+        list[Result]: The measurements.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        root = Path(folder)
+        file, user_ids = generate(root, users)
+        month_text = file.read_text()
+        # loading, saving and rolling over take seconds on large months, run them less
+        slow_runs = max(1, min(runs, 10_000 // users))
+        results = [measure("load", lambda _: Database(file), slow_runs)]
+        database = Database(file)
+        rng = random.Random(1)
+        new_ids = iter(range(1, 10**9))
+
+        def write(_):
+            # faster than every generated time, so it is always accepted
+            database.write(User(rng.choice(user_ids)), CourseTime(100), 1)
+
+        results.append(measure("write", write, runs))
+        results.append(
+            measure(
+                "write + save",
+                lambda _: (write(None), database.save()),
+                slow_runs,
+            )
+        )
+        results.append(
+            measure(
+                "register_user",
+                lambda _: database.register_user(users=[next(new_ids)]),
+                runs,
+            )
+        )
+        results.append(
+            measure("leaderboard", lambda _: database.leaderboard(3, PAGE_SIZE), runs)
+        )
+        places = database.leaderboard(3, PAGE_SIZE)
+        total = len(database.rankings[3])
+        results.append(
+            measure(
+                "leaderboard_embed",
+                lambda _: leaderboard_embed(places, 3, 0, PAGE_SIZE, total),
+                runs,
+            )
+        )
+        year, month = ARCHIVED_MONTHS[0]
+
+        def cold_archive():
+            archive.archives = archive.ArchiveCache()
+
+        results.append(
+            measure(
+                "stats_embed (cold)",
+                lambda _: stats_embed(User(user_ids[0]), year, month, root),
+                slow_runs,
+                setup=cold_archive,
+            )
+        )
+        results.append(
+            measure(
+                "stats_embed (cached)",
+                lambda _: stats_embed(User(user_ids[0]), year, month, root),
+                runs,
+            )
+        )
+
+        def generated_month():
+            # each rollover starts from the generated month, in a folder of its own
+            month_file = Path(tempfile.mkdtemp(dir=root)) / "database.toml"
+            month_file.write_text(month_text)
+            return Database(month_file)
+
+        results.append(
+            measure(
+                "rollover",
+                lambda database: database.rollover(next_reset()),
+                slow_runs,
+                setup=generated_month,
+            )
+        )
+        return results
+
+
+def report(users: int, results: list[Result], baseline: Optional[dict]) -> None:
+    """Print a size's measurements as a table, with the change from a baseline."""
+    print(f"\n{users} users")
+    print(
+        f"{'operation':<22}{'runs':>6}{'p50 ms':>11}{'max ms':>11}{'bytes/op':>12}{'peak KiB':>11}"
+    )
+    for result in results:
+        written = "n/a" if result.bytes_written is None else str(result.bytes_written)
+        line = f"{result.name:<22}{result.runs:>6}{result.p50_ms:>11.3f}{result.max_ms:>11.3f}{written:>12}{result.peak_kib:>11.1f}"
+        old = (baseline or {}).get(str(users), {}).get(result.name)
+        if old is not None and old["p50_ms"] > 0:
+            line += f"  ({result.p50_ms / old['p50_ms']:.2f}x p50)"
+        print(line)
+
+
+def main(args: Optional[list[str]] = None) -> None:
+    """Run the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--users",
+        type=int,
+        nargs="+",
+        default=list(SIZES),
+        help="The month sizes to benchmark, in registered users.",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=200, help="Timed runs of the cheap operations."
+    )
+    parser.add_argument(
+        "--save", type=Path, help="Write the measurements to this JSON file."
+    )
+    parser.add_argument(
+        "--compare", type=Path, help="Show the change from measurements saved earlier."
+    )
+    options = parser.parse_args(args)
+    baseline = json.loads(options.compare.read_text()) if options.compare else None
+    saved: dict[str, dict] = {}
+    for users in options.users:
+        results = run_size(users, options.runs)
+        report(users, results, baseline)
+        saved[str(users)] = {result.name: vars(result) for result in results}
+    if options.save:
+        options.save.write_text(json.dumps(saved, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+# SPDX-FileCopyrightText: 2023 osfanbuff63
+#
+# SPDX-License-Identifier: Apache-2.0
+"""An offline load test of the commands and leaderboard buttons.
+
+The cogs are driven directly with stand-in interactions against a generated
+database in a temporary folder, without connecting to Discord. Each level of
+concurrency keeps that many interactions in flight, and the time from an
+interaction arriving to the bot starting its response (the first
+`send_message`, `defer` or `edit_message`) is reported, since Discord drops
+interactions that aren't responded to within 3 seconds. Run it from the
+repository root:
+
+    python -m benchmarks.loadtest --users 10000 --concurrency 10 100 1000
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Optional
+
+import discord
+
+import pkw_tracking_bot
+from pkw_tracking_bot import Archive, Buttons, MainCog, create_bot, database_for
+from pkw_tracking_bot.database import open_databases
+from pkw_tracking_bot.persistence import writer
+
+from .bench import ARCHIVED_MONTHS, generate
+
+# Discord drops interactions that aren't responded to within this many seconds
+RESPONSE_DEADLINE = 3.0
+# the share of each kind of interaction in the workload
+MIX = {"submit": 0.4, "leaderboard": 0.2, "refresh": 0.3, "archive": 0.1}
+# leaderboard messages the refresh presses are spread over, so some coalesce
+MESSAGES = 5
+
+
+class Member(discord.Member):
+    """Stands in for a guild member, which the commands check with `isinstance`."""
+
+    def __init__(self, id: int, moderator: bool = False) -> None:  # type: ignore
+        """Initialize the member.
+
+        Args:
+            id (int): The user ID.
+            moderator (bool, optional): Whether they have the Moderate Members permission. Defaults to False.
+        """
+        self._id = id
+        self._moderator = moderator
+
+    @property
+    def id(self) -> int:  # type: ignore
+        """The user ID."""
+        return self._id
+
+    @property
+    def mention(self) -> str:
+        """The mention of the user."""
+        return f"<@{self._id}>"
+
+    @property
+    def guild_permissions(self) -> discord.Permissions:
+        """Moderate Members for moderators, nothing otherwise."""
+        return discord.Permissions(moderate_members=self._moderator)
+
+    def __str__(self) -> str:
+        """The user ID, as there is no name."""
+        return str(self._id)
+
+
+class Response:
+    """Stands in for `discord.InteractionResponse`, noting when the response started."""
+
+    def __init__(self, interaction: "Interaction") -> None:
+        """Initialize the response."""
+        self.interaction = interaction
+        self.started: Optional[float] = None
+
+    async def _respond(self, *args: Any, **kwargs: Any) -> None:
+        if self.started is None:
+            self.started = time.perf_counter()
+        # the request to Discord
+        await asyncio.sleep(self.interaction.rtt)
+
+    send_message = defer = edit_message = _respond
+
+    def is_done(self) -> bool:
+        """Whether the interaction was responded to."""
+        return self.started is not None
+
+
+class Interaction:
+    """Stands in for `discord.Interaction`, with what the commands and buttons use."""
+
+    def __init__(
+        self,
+        user: Member,
+        guild_id: int,
+        rtt: float,
+        custom_id: Optional[str] = None,
+        message_id: int = 0,
+    ) -> None:
+        """Initialize the interaction.
+
+        Args:
+            user (Member): Who used the command or pressed the button.
+            guild_id (int): The guild it was used in.
+            rtt (float): How long each request to Discord takes, in seconds.
+            custom_id (str, optional): The custom ID of the pressed button, for button presses. Defaults to None.
+            message_id (int, optional): The ID of the message the button is on. Defaults to 0.
+        """
+        self.user = user
+        self.guild_id = guild_id
+        self.rtt = rtt
+        self.created = time.perf_counter()
+        self.extras: dict = {}
+        self.command = None
+        self.response = Response(self)
+        self.followup = self
+        if custom_id is None:
+            self.type = discord.InteractionType.application_command
+            self.data: dict = {}
+        else:
+            self.type = discord.InteractionType.component
+            self.data = {"custom_id": custom_id}
+        self.message = discord.Object(message_id)
+
+    async def send(self, *args: Any, **kwargs: Any) -> None:
+        """Send a followup message."""
+        await asyncio.sleep(self.rtt)
+
+    async def edit_original_response(self, *args: Any, **kwargs: Any) -> None:
+        """Edit the message responded with."""
+        await asyncio.sleep(self.rtt)
+
+
+def _time_text(rng: random.Random) -> str:
+    centiseconds = rng.randint(3_000, 30_000)
+    return (
+        f"{centiseconds // 6000}:{centiseconds // 100 % 60:02}.{centiseconds % 100:02}"
+    )
+
+
+async def _interact(
+    kind: str,
+    main: MainCog,
+    archive: Archive,
+    user_ids: list[int],
+    rng: random.Random,
+    rtt: float,
+) -> tuple[Interaction, Optional[Exception]]:
+    """Run one interaction of a kind, returning it and what it raised once it is handled."""
+    member = Member(rng.choice(user_ids))
+    course = rng.randint(1, 7)
+    match kind:
+        case "submit":
+            interaction = Interaction(member, 1, rtt)
+            call = MainCog.submit.callback(
+                main, interaction, time=_time_text(rng), course=course
+            )  # type: ignore
+        case "leaderboard":
+            interaction = Interaction(member, 1, rtt)
+            call = MainCog.leaderboard.callback(main, interaction, course=course)  # type: ignore
+        case "refresh":
+            interaction = Interaction(
+                member,
+                1,
+                rtt,
+                custom_id=f"{Buttons.PREFIX}refresh:{course}:0:current",
+                message_id=rng.randrange(MESSAGES),
+            )
+            call = Buttons.dispatch(interaction)  # type: ignore
+        case "archive":
+            year, month = ARCHIVED_MONTHS[0]
+            interaction = Interaction(member, 1, rtt)
+            call = Archive.leaderboard.callback(
+                archive, interaction, year=year, month=month, course=course
+            )  # type: ignore
+        case _:
+            raise ValueError(f"Unknown interaction: {kind}")
+    try:
+        await call
+    except Exception as e:
+        # the commands raise after responding with an error, like for a slower time
+        return interaction, e
+    return interaction, None
+
+
+async def run_level(
+    concurrency: int,
+    requests: int,
+    main: MainCog,
+    archive: Archive,
+    user_ids: list[int],
+    rtt: float,
+    seed: int = 0,
+) -> None:
+    """Run a workload with a number of interactions in flight and print its results.
+
+    Args:
+        concurrency (int): The number of interactions in flight at once.
+        requests (int): The total number of interactions.
+        main (MainCog): The main cog.
+        archive (Archive): The archive cog.
+        user_ids (list[int]): The registered users to act as.
+        rtt (float): How long each request to Discord takes, in seconds.
+        seed (int, optional): The random seed. Defaults to 0.
+    """
+    rng = random.Random(seed)
+    kinds = rng.choices(list(MIX), weights=list(MIX.values()), k=requests)
+    latencies: dict[str, list[float]] = defaultdict(list)
+    unanswered = 0
+    # (kind, exception type) -> how many raised before responding
+    failures: dict[tuple[str, str], int] = defaultdict(int)
+
+    async def client() -> None:
+        nonlocal unanswered
+        while kinds:
+            kind = kinds.pop()
+            interaction, error = await _interact(
+                kind, main, archive, user_ids, rng, rtt
+            )
+            if interaction.response.started is None:
+                unanswered += 1
+                if error is not None:
+                    failures[kind, type(error).__name__] += 1
+            else:
+                latencies[kind].append(
+                    interaction.response.started - interaction.created
+                )
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    print(
+        f"\n{concurrency} in flight: {requests} interactions in {elapsed:.2f}s, {requests / elapsed:.0f}/s"
+    )
+    print(f"{'interaction':<14}{'count':>7}{'p50 ms':>10}{'p99 ms':>10}{'late':>7}")
+    for kind, values in sorted(latencies.items()) + [
+        ("all", [value for values in latencies.values() for value in values])
+    ]:
+        if len(values) > 1:
+            percentiles = statistics.quantiles(values, n=100)
+            p50, p99 = percentiles[49], percentiles[98]
+        else:
+            p50 = p99 = values[0] if values else 0.0
+        late = sum(value > RESPONSE_DEADLINE for value in values)
+        print(
+            f"{kind:<14}{len(values):>7}{p50 * 1000:>10.1f}{p99 * 1000:>10.1f}{late:>7}"
+        )
+    if unanswered:
+        print(f"{unanswered} interactions were never responded to.")
+    for (kind, error), count in sorted(failures.items()):
+        print(f"{kind} raised {error} before responding {count} times.")
+
+
+async def main(args: Optional[list[str]] = None) -> None:
+    """Run the load test from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--users", type=int, default=1_000, help="Registered users in the database."
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=[1, 10, 100],
+        help="The numbers of interactions in flight to test, one after another.",
+    )
+    parser.add_argument(
+        "--requests", type=int, default=1_000, help="Interactions per level."
+    )
+    parser.add_argument(
+        "--rtt",
+        type=float,
+        default=0.05,
+        help="Seconds each request to Discord takes.",
+    )
+    options = parser.parse_args(args)
+    with tempfile.TemporaryDirectory() as folder:
+        file, user_ids = generate(Path(folder), options.users)
+        pkw_tracking_bot.database_path = file
+        bot = create_bot()
+        main_cog, archive_cog = MainCog(bot), Archive()
+        database = await database_for(None)
+        if not all(len(ranking) for ranking in database.rankings.values()):
+            # an empty board renders much faster, which would hide what is measured
+            raise RuntimeError(f"{file} was loaded without places on every course.")
+        for concurrency in options.concurrency:
+            await run_level(
+                concurrency,
+                options.requests,
+                main_cog,
+                archive_cog,
+                user_ids,
+                options.rtt,
+            )
+        for database in open_databases():
+            await database.flush()
+        await writer.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -4,188 +4,429 @@
 """The main bot."""
 
 import asyncio
-import logging
-import sys
+import datetime
+import time
+from functools import partial
 import arrow
-from string import Template
 from typing import Optional
 
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.ext.commands import Context
 
 from . import _constants
-from .database import Database
-from .embeds import error_embed, leaderboard_embed, success_embed, stats_embed
+from .archive import ArchiveMonth, archive_path, open_archive
+from .bulk import parse_rows
+from .coalesce import SingleFlight
+from .database import (
+    Database,
+    close_idle_databases,
+    is_open,
+    open_database,
+    open_databases,
+)
+from .embeds import (
+    MAX_PAGE_SIZE,
+    PAGE_SIZE,
+    cached_leaderboard_embed,
+    error_embed,
+    forget_leaderboard_embeds,
+    history_embed,
+    import_embed,
+    metrics_embed,
+    page_count,
+    stats_embed,
+    success_embed,
+)
 from .exceptions import (
     CourseException,
     DateException,
     DiscordLibException,
+    OwnerException,
     TimeException,
 )
-from .logger import handler, logger
+from .history import merged_leaderboard
+from .logger import handler, level as log_level, logger
+from .metrics import metrics
+from .persistence import writer as default_writer
+from .times import RESET_HOUR, CourseTime
 from pathlib import Path
 
 token = _constants.TOKEN
-intents = discord.Intents.default()
-intents.message_content = True
-bot = commands.Bot("!!", intents=intents)  # type: ignore
+# a .db/.sqlite/.sqlite3 path selects the SQLite backend
+database_path = Path(getattr(_constants, "DATABASE", "database.toml"))
+# places per leaderboard page, capped so a page fits in one embed
+page_size = max(
+    1, min(getattr(_constants, "LEADERBOARD_PAGE_SIZE", PAGE_SIZE), MAX_PAGE_SIZE)
+)
+# presses showing the same leaderboard page within this many seconds share one message edit
+refreshes = SingleFlight(getattr(_constants, "REFRESH_INTERVAL", 1.0))
+# a Prometheus textfile the metrics are written to every METRICS_INTERVAL seconds, None to not write one
+metrics_file = getattr(_constants, "METRICS_FILE", None)
+metrics_interval = getattr(_constants, "METRICS_INTERVAL", 60.0)
+# seconds from starting to being online before a slow start is logged as a warning
+startup_budget = getattr(_constants, "STARTUP_BUDGET", 10.0)
+# give every guild its own database and archive, instead of sharing one
+guild_databases = getattr(_constants, "GUILD_DATABASES", False)
+# seconds a database stays loaded after it was last used
+idle_timeout = getattr(_constants, "IDLE_TIMEOUT", 600.0)
+
+
+def create_bot(sharded: bool = getattr(_constants, "SHARDED", False)) -> commands.Bot:
+    """Create the bot. Nothing is connected or loaded until it is started.
+
+    Args:
+        sharded (bool, optional): Whether to run as an `AutoShardedBot`. Defaults to `SHARDED` from the constants, or False.
+    """
+    intents = discord.Intents.default()
+    intents.message_content = True
+    bot_class = commands.AutoShardedBot if sharded else commands.Bot
+    return bot_class("!!", intents=intents)  # type: ignore
+
+
+def database_file(guild_id: Optional[int]) -> Path:
+    """Get the database file of a guild.
+
+    With `GUILD_DATABASES` set, each guild's database is kept in
+    `guilds/<guild ID>/` next to `DATABASE`, with its own `database_archive`.
+    Otherwise, and outside guilds, every guild shares `DATABASE`.
+
+    Args:
+        guild_id (Optional[int]): The guild's ID.
+
+    Returns:
+        Path: The database file.
+    """
+    if guild_databases and guild_id is not None:
+        return database_path.parent / "guilds" / str(guild_id) / database_path.name
+    return database_path
+
+
+async def database_for(guild_id: Optional[int]) -> Database:
+    """Get a guild's database, loading it on the writer thread if it isn't loaded.
+
+    Args:
+        guild_id (Optional[int]): The guild's ID.
+
+    Returns:
+        Database: The database.
+    """
+    file = database_file(guild_id)
+    if is_open(file):
+        return open_database(file)
+    started = time.perf_counter()
+    database = await default_writer.submit(open_database, file)
+    logger.info(f"Loaded {file} in {time.perf_counter() - started:.2f}s.")
+    # catch up on a reset missed while it was unloaded
+    if database.needs_rollover():
+        await database.writer.submit(database.rollover)
+    return database
+
+
+async def main() -> None:
+    """Set up the bot and run it, all on one event loop."""
+    started = time.perf_counter()
+    bot = create_bot()
+    async with bot:
+        await bot.add_cog(MainCog(bot, started))
+        await bot.add_cog(Archive())
+        logger.info(f"Set up the cogs in {time.perf_counter() - started:.2f}s.")
+        await bot.start(token)
 
 
 def run() -> None:
     """Run the bot."""
-    bot.remove_command("sync")  # type: ignore
-    asyncio.run(bot.add_cog(MainCog(bot)))  # type: ignore
-    asyncio.run(bot.add_cog(Archive()))  # type: ignore
+    discord.utils.setup_logging(handler=handler, level=log_level)
     try:
-        asyncio.run(bot.run(token, log_handler=handler, log_level=logging.DEBUG))  # type: ignore
-    except ValueError:
+        asyncio.run(main())
+    except KeyboardInterrupt:
         print("KeyboardInterrupt, exiting!")
         logger.info("KeyboardInterrupt, exiting!")
-        sys.exit(0)
 
 
 class Buttons(discord.ui.View):
-    """The leaderboard buttons."""
+    """The leaderboard buttons.
+
+    Each button carries the leaderboard it belongs to in its custom ID, as
+    `pkw:leaderboard:<action>:<course>:<page>:<month>`, where the month is
+    `current` or `<year>-<month>` for an archived month. Presses are handled by
+    `Buttons.dispatch` from that state alone, so no view is kept per message and
+    the buttons keep working after the bot restarts.
+    """
 
-    def __init__(self, *, timeout=None, path: Path = Path("database.toml")):
+    PREFIX = "pkw:leaderboard:"
+
+    def __init__(
+        self,
+        course: int = 1,
+        page: int = 0,
+        month: Optional[tuple[int, int]] = None,
+        pages: int = 1,
+    ):
         """Initialize the leaderboard buttons.
 
         Args:
-            timeout (int, optional): The time in which the buttons will no longer work. Defaults to None.
-            path (Path, optional): The path to the database to use. Defaults to the main database (database.toml).
+            course (int, optional): The course shown. Defaults to 1.
+            page (int, optional): The page shown, starting at 0. Defaults to 0.
+            month (tuple[int, int], optional): The year and month of the archived month shown. Defaults to the current month.
+            pages (int, optional): The number of pages the course has. Defaults to 1.
         """
-        super().__init__(timeout=timeout)
-        self.database = Database(path)
-
-    @discord.ui.button(  # type: ignore
-        label="Refresh", style=discord.ButtonStyle.blurple, emoji="🔄"
-    )  # or .primary
-    async def refresh_button(
-        self, interaction: discord.Interaction, button: discord.ui.Button
-    ):
-        """The refresh button."""
-        # why do i have to have so many type ignore comments...
-        embeds = interaction.message.embeds  # type: ignore
-        for embed in embeds:  # type: ignore
-            if embed.title.find("Course 1") != -1:  # type: ignore
-                course = 1
-            if embed.title.find("Course 2") != -1:  # type: ignore
-                course = 2
-            if embed.title.find("Course 3") != -1:  # type: ignore
-                course = 3
-            if embed.title.find("Course 4") != -1:  # type: ignore
-                course = 4
-            if embed.title.find("Course 5") != -1:  # type: ignore
-                course = 5
-            if embed.title.find("Course 6") != -1:  # type: ignore
-                course = 6
-            if embed.title.find("Course 7") != -1:  # type: ignore
-                course = 7
-        all_times, best_time = self.database.leaderboard(course)
-        registered_users = self.database.get("registered_users")
-        embed = leaderboard_embed(all_times, best_time, registered_users, course)
-        await interaction.response.edit_message(view=self, embed=embed)
-
-    @discord.ui.button(  # type: ignore
-        label="Previous Course", style=discord.ButtonStyle.gray, emoji="⬅️"
-    )  # or .secondary/.grey
-    async def previous_course_button(
-        self, interaction: discord.Interaction, button: discord.ui.Button
-    ):
-        """The previous course button."""
-        embeds = interaction.message.embeds  # type: ignore
-        for embed in embeds:  # type: ignore
-            if embed.title.find("Course 1") != -1:  # type: ignore
-                course = 1
-            if embed.title.find("Course 2") != -1:  # type: ignore
-                course = 2
-            if embed.title.find("Course 3") != -1:  # type: ignore
-                course = 3
-            if embed.title.find("Course 4") != -1:  # type: ignore
-                course = 4
-            if embed.title.find("Course 5") != -1:  # type: ignore
-                course = 5
-            if embed.title.find("Course 6") != -1:  # type: ignore
-                course = 6
-            if embed.title.find("Course 7") != -1:  # type: ignore
-                course = 7
-        if course > 1:
-            course -= 1
-        else:
-            await interaction.response.send_message(
-                "You cannot decrement the course if it is 1!", ephemeral=True
+        super().__init__(timeout=None)
+        state = f"{course}:{page}:{'current' if month is None else '-'.join(map(str, month))}"
+        for action, label, style, emoji, row, disabled in (
+            ("refresh", "Refresh", discord.ButtonStyle.blurple, "🔄", 0, False),
+            ("previous_course", "Previous Course", discord.ButtonStyle.gray, "⬅️", 0, course <= 1),
+            ("next_course", "Next Course", discord.ButtonStyle.gray, "➡️", 0, course >= 7),
+            ("previous_page", "Previous Page", discord.ButtonStyle.gray, "🔼", 1, page <= 0),
+            ("next_page", "Next Page", discord.ButtonStyle.gray, "🔽", 1, page + 1 >= pages),
+        ):  # fmt: skip
+            self.add_item(
+                discord.ui.Button(
+                    label=label,
+                    style=style,
+                    emoji=emoji,
+                    row=row,
+                    disabled=disabled,
+                    custom_id=f"{self.PREFIX}{action}:{state}",
+                )
             )
-        all_times, best_time = self.database.leaderboard(course)
-        registered_users = self.database.get("registered_users")
-        embed = leaderboard_embed(all_times, best_time, registered_users, course)
-        await interaction.response.edit_message(view=self, embed=embed)
-
-    @discord.ui.button(  # type: ignore
-        label="Next Course",
-        style=discord.ButtonStyle.gray,
-        emoji="➡️",
-    )  # or .success
-    async def next_course_button(
-        self, interaction: discord.Interaction, button: discord.ui.Button
-    ):
-        """The next course button."""
-        embeds = interaction.message.embeds  # type: ignore
-        for embed in embeds:  # type: ignore
-            if embed.title.find("Course 1") != -1:  # type: ignore
-                course = 1
-            if embed.title.find("Course 2") != -1:  # type: ignore
-                course = 2
-            if embed.title.find("Course 3") != -1:  # type: ignore
-                course = 3
-            if embed.title.find("Course 4") != -1:  # type: ignore
-                course = 4
-            if embed.title.find("Course 5") != -1:  # type: ignore
-                course = 5
-            if embed.title.find("Course 6") != -1:  # type: ignore
-                course = 6
-            if embed.title.find("Course 7") != -1:  # type: ignore
-                course = 7
-        if course < 7:
-            course += 1
+        # presses are dispatched by custom ID, so discord.py doesn't need to keep this view
+        self.stop()
+
+    @classmethod
+    def show(
+        cls,
+        database: Database | ArchiveMonth,
+        course: int,
+        page: int = 0,
+        month: Optional[tuple[int, int]] = None,
+    ) -> tuple[discord.Embed, "Buttons"]:
+        """Get the embed and buttons for a page of a leaderboard.
+
+        Args:
+            database (Database | ArchiveMonth): The database or archived month to show.
+            course (int): The course to show.
+            page (int, optional): The page to show, starting at 0. Defaults to 0.
+            month (tuple[int, int], optional): The year and month, if `database` is an archived month. Defaults to None.
+
+        Returns:
+            tuple[discord.Embed, Buttons]: The embed and its buttons.
+        """
+        pages = page_count(len(database.rankings[course]), page_size)
+        page = min(max(page, 0), pages - 1)
+        embed = cached_leaderboard_embed(database, course, page, page_size)
+        return embed, cls(course, page, month, pages)
+
+    @classmethod
+    async def dispatch(cls, interaction: discord.Interaction) -> bool:
+        """Handle a press of a leaderboard button.
+
+        Args:
+            interaction (discord.Interaction): Any interaction.
+
+        Returns:
+            bool: Whether the interaction was a leaderboard button press.
+        """
+        if interaction.type is not discord.InteractionType.component:
+            return False
+        custom_id = str((interaction.data or {}).get("custom_id", ""))
+        if not custom_id.startswith(cls.PREFIX):
+            return False
+        try:
+            action, course, page, month = custom_id.removeprefix(cls.PREFIX).split(":")
+            course, page = int(course), int(page)
+            archived = None if month == "current" else tuple(map(int, month.split("-")))
+        except ValueError:
+            logger.error(f"Invalid leaderboard button: {custom_id}")
+            return False
+        with metrics.timed("pkw_button_seconds", action=action):
+            await cls._press(interaction, action, course, page, archived)
+        return True
+
+    @classmethod
+    async def _press(
+        cls,
+        interaction: discord.Interaction,
+        action: str,
+        course: int,
+        page: int,
+        archived: Optional[tuple[int, int]],
+    ) -> None:
+        match action:
+            case "previous_course":
+                course, page = max(course - 1, 1), 0
+            case "next_course":
+                course, page = min(course + 1, 7), 0
+            case "previous_page":
+                page -= 1
+            case "next_page":
+                page += 1
+        if archived is None:
+            database = await database_for(interaction.guild_id)
         else:
-            await interaction.response.send_message(
-                "You cannot increment the course if it is 7!", ephemeral=True
-            )
-        all_times, best_time = self.database.leaderboard(course)
-        registered_users = self.database.get("registered_users")
-        embed = leaderboard_embed(all_times, best_time, registered_users, course)
-        await interaction.response.edit_message(view=self, embed=embed)
+            try:
+                # a month that isn't cached is parsed, which can take a while
+                database = await asyncio.to_thread(
+                    open_archive,
+                    archive_path(*archived, database_file(interaction.guild_id).parent),  # type: ignore
+                )
+            except FileNotFoundError as e:
+                logger.exception("The archived month of a leaderboard was deleted.")
+                await interaction.response.send_message(
+                    embed=error_embed(e, "This archived month no longer exists."),
+                    ephemeral=True,
+                )
+                return
+        embed, view = cls.show(database, course, page, archived)  # type: ignore
+        # edits to one message run one at a time, and embeds compare by content (course, page and places)
+        key = interaction.message.id  # type: ignore
+        if refreshes.pending(key, embed):
+            # another press is already showing this, so only acknowledge this one
+            await interaction.response.defer()
+            edit = partial(interaction.edit_original_response, embed=embed, view=view)
+        else:
+            edit = partial(interaction.response.edit_message, embed=embed, view=view)
+        await refreshes.run(key, embed, edit)
+
+
+def _command_started(interaction: discord.Interaction) -> bool:
+    """Note when an app command reached the bot, see `_command_finished`."""
+    interaction.extras["started"] = time.perf_counter()
+    return True
+
+
+def _command_finished(interaction: discord.Interaction, status: str) -> None:
+    """Record how long an app command took in `pkw_command_seconds`."""
+    started = interaction.extras.get("started")
+    if started is None or interaction.command is None:
+        return
+    metrics.observe(
+        "pkw_command_seconds",
+        time.perf_counter() - started,
+        command=interaction.command.qualified_name,
+        status=status,
+    )
 
 
 class MainCog(commands.Cog):
     """The main cog."""
 
-    def __init__(self, bot: commands.Bot) -> None:
+    def __init__(self, bot: commands.Bot, started: Optional[float] = None) -> None:
         """Initialize the main cog, which holds all the commands for the bot.
 
         Args:
             bot (commands.Bot): The affiliated bot object.
+            started (float, optional): When startup began, from `time.perf_counter`, to measure the time until the bot is online. Defaults to not measuring it.
         """
         self.bot = bot
-        self.database = Database(Path("database.toml"))
+        self.started = started
+        self._loading: Optional[asyncio.Task] = None
         self.permissions = discord.Permissions(
             274877975616
         )  # send messages [in threads], read messages [history], add reactions
 
-    @bot.event
-    async def on_ready():  # type: ignore
+    async def cog_load(self) -> None:
+        """Start the background tasks."""
+        # load the database while the bot logs in, rather than before
+        self._loading = asyncio.create_task(self.load_database())
+        self.compact_database.start()
+        self.roll_over_month.start()
+        if metrics_file is not None:
+            self.write_metrics.change_interval(seconds=metrics_interval)
+            self.write_metrics.start()
+
+    async def load_database(self) -> None:
+        """Load the shared database, which every guild uses unless they have their own."""
+        if not guild_databases:
+            await database_for(None)
+
+    async def cog_unload(self) -> None:
+        """Wait for pending database writes before the cog is removed."""
+        if self._loading is not None:
+            await self._loading
+        self.compact_database.cancel()
+        self.roll_over_month.cancel()
+        self.write_metrics.cancel()
+        for database in open_databases():
+            await database.flush()
+        await default_writer.close()
+
+    @tasks.loop(seconds=60)
+    async def compact_database(self) -> None:
+        """Flush regularly, so journals get compacted even when nobody submits times, and unload idle databases."""
+        for database in open_databases():
+            await database.flush()
+        # the shared database is used by every guild without its own, so it stays loaded
+        closed = await default_writer.submit(
+            close_idle_databases, idle_timeout, database_file(None)
+        )
+        forget_leaderboard_embeds(closed)
+
+    @compact_database.before_loop
+    async def before_compact_database(self) -> None:
+        """Wait for the database to load, so the first flush doesn't load it on the event loop."""
+        await asyncio.shield(self._loading)  # type: ignore
+
+    @tasks.loop(time=datetime.time(hour=RESET_HOUR, tzinfo=datetime.timezone.utc))
+    async def roll_over_month(self) -> None:
+        """Start a new month once the courses reset, see `Database.rollover`.
+
+        Databases that aren't loaded start theirs when they are next loaded.
+        """
+        for database in open_databases():
+            if database.needs_rollover():
+                await database.writer.submit(database.rollover)
+
+    @tasks.loop(seconds=60)
+    async def write_metrics(self) -> None:
+        """Write the metrics to `METRICS_FILE`, for node-exporter's textfile collector."""
+        await asyncio.to_thread(metrics.write_textfile, Path(metrics_file))  # type: ignore
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:  # type: ignore
+        """Start timing the cog's app commands."""
+        return _command_started(interaction)
+
+    async def cog_app_command_error(
+        self, interaction: discord.Interaction, error: app_commands.AppCommandError
+    ) -> None:
+        """Time the cog's app commands that fail."""
+        _command_finished(interaction, "error")
+
+    @commands.Cog.listener()
+    async def on_app_command_completion(
+        self, interaction: discord.Interaction, command: app_commands.Command
+    ) -> None:
+        """Time every app command that finishes."""
+        _command_finished(interaction, "ok")
+
+    @commands.Cog.listener()
+    async def on_interaction(self, interaction: discord.Interaction) -> None:
+        """Handle leaderboard button presses, see `Buttons`."""
+        await Buttons.dispatch(interaction)
+
+    @commands.Cog.listener()
+    async def on_ready(self) -> None:
         """Things to do once the bot is ready."""
-        logger.info(f"{bot.user} has connected to Discord!")
+        logger.info(f"{self.bot.user} has connected to Discord!")
         url = discord.utils.oauth_url(
-            bot.user.id,  # type: ignore
-            permissions=discord.Permissions(274877975616),
+            self.bot.user.id,  # type: ignore
+            permissions=self.permissions,
             scopes=["bot", "applications.commands"],
         )
         logger.info(f"Invite link: {url}")
+        if self.started is not None:
+            # on_ready also fires after reconnecting, only the first one is the startup
+            elapsed = time.perf_counter() - self.started
+            self.started = None
+            if elapsed > startup_budget:
+                logger.warning(
+                    f"Online {elapsed:.2f}s after starting, over the {startup_budget}s budget."
+                )
+            else:
+                logger.info(f"Online {elapsed:.2f}s after starting.")
 
-    @bot.command("sync")  # type: ignore
+    @commands.command("sync")
     @commands.guild_only()
     @commands.is_owner()
     async def sync(self, ctx: Context) -> None:
@@ -193,11 +434,30 @@ class MainCog(commands.Cog):
         await self.bot.tree.sync()
         await ctx.reply("Synced application commands.")
 
+    @app_commands.command(name="metrics")
+    async def show_metrics(self, interaction: discord.Interaction) -> None:
+        """Show how long commands and database operations take. Only the owner of the bot can use this."""
+        if not await self.bot.is_owner(interaction.user):  # type: ignore
+            try:
+                raise OwnerException()
+            except OwnerException as e:
+                logger.exception("Someone other than the owner asked for the metrics.")
+                await interaction.response.send_message(
+                    embed=error_embed(
+                        e, "Only the owner of the bot can see its metrics."
+                    ),
+                    ephemeral=True,
+                )
+                raise OwnerException from e  # stops command from continuing to run
+        await interaction.response.send_message(
+            embed=metrics_embed(metrics), ephemeral=True
+        )
+
     @app_commands.command(name="ping", description="Ping the bot.")
     async def ping(self, interaction: discord.Interaction) -> None:
         """Ping the bot to make sure it is online."""
         await interaction.response.send_message(
-            f"Pong! Ping: {format(round(bot.latency, 1))}"  # type: ignore
+            f"Pong! Ping: {format(round(self.bot.latency, 1))}"
         )
 
     @app_commands.command(name="submit")
@@ -249,7 +509,7 @@ class MainCog(commands.Cog):
                 "The discord.py library did not give the expected value. Did you try to run it in a DM?"
             )
         # await interaction.response.defer()
-        logger.debug(f"advanced: {advanced}")
+        logger.debug("advanced: %s", advanced)
         if course not in [1, 2, 3, 4, 5, 6, 7]:
             try:
                 raise CourseException()
@@ -261,19 +521,34 @@ class MainCog(commands.Cog):
                 )
                 await interaction.response.send_message(embed=embed)
                 raise CourseException from e  # stops command from continuing to run
-        time_str = Template("$minute:$second")
-        time_data_fmt = time_str.substitute(
-            minute=time.split(":")[0], second=time.split(":")[1]
-        )
+        try:
+            course_time = CourseTime.parse(time)
+        except TimeException as e:
+            logger.exception("The time given was invalid.")
+            embed = error_embed(
+                e,
+                "The time you gave was not valid. Times should look like `1:23.45`.",
+            )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+            raise TimeException from e  # stops command from continuing to run
         logger.debug(
-            f"Time being submitted by {real_user}: {time_data_fmt} (advanced: {advanced})"
+            "Time being submitted by %s: %s (advanced: %s)",
+            real_user,
+            course_time,
+            advanced,
         )
+        database = await database_for(interaction.guild_id)
         try:
-            self.database.write(real_user, time_data_fmt, course, advanced)
+            error = await database.submit(real_user.id, course_time, course, advanced)
+            if error is not None:
+                raise error
             if advanced is True:
-                description = f"{real_user.mention}'s Advanced Completion time of **{time_data_fmt}** on Course {course} was successfully added to the leaderboard."
+                description = f"{real_user.mention}'s Advanced Completion time of **{course_time}** on Course {course} was successfully added to the leaderboard."
             else:
-                description = f"{real_user.mention}'s time of **{time_data_fmt}** on Course {course} was successfully added to the leaderboard."
+                description = f"{real_user.mention}'s time of **{course_time}** on Course {course} was successfully added to the leaderboard."
+            description += (
+                f" They are now #{database.rank(real_user.id, course)} on this course."
+            )
             await interaction.response.send_message(embed=success_embed(description))
         except TimeException as e:
             logger.exception("Stored time was shorter than the given time.")
@@ -301,12 +576,63 @@ class MainCog(commands.Cog):
                 )
                 await interaction.response.send_message(embed=embed)
                 raise CourseException from e  # stops command from continuing to run
-        all_times, best_time = self.database.leaderboard(course)
-        registered_users = self.database.get("registered_users")
-        embed = leaderboard_embed(all_times, best_time, registered_users, course)
-        view = Buttons()
+        embed, view = Buttons.show(await database_for(interaction.guild_id), course)
         await interaction.response.send_message(embed=embed, view=view)
 
+    @app_commands.command(name="import")
+    @app_commands.guild_only()
+    async def bulk_import(
+        self, interaction: discord.Interaction, file: discord.Attachment
+    ):
+        """Submit many times at once from a CSV or TSV file. You must have the 'Moderate Members' permission to do this.
+
+        Args:
+            file (discord.Attachment): One `user, course, time, advanced` row per time. The user can be an ID or a mention, and advanced can be left out.
+        """
+        if not isinstance(interaction.user, discord.Member):
+            raise DiscordLibException(
+                "The discord.py library did not give the expected value. Did you try to run it in a DM?"
+            )
+        if not interaction.user.guild_permissions.moderate_members:
+            try:
+                raise PermissionError(
+                    "You must have Moderate Members permission in this guild to import times!"
+                )
+            except PermissionError as e:
+                logger.exception("User tried to import times and is not a moderator!")
+                embed = error_embed(
+                    e,
+                    "You don't have the Moderate Members permission on this server, which means you cannot import times. If this is in error, please let <@995310680909549598> know.",
+                )
+                await interaction.response.send_message(embed=embed, ephemeral=True)
+                raise PermissionError from e
+        # downloading and applying a big file can take longer than Discord waits for a response
+        await interaction.response.defer(thinking=True)
+        try:
+            text = (await file.read()).decode("utf-8-sig")
+        except UnicodeDecodeError as e:
+            logger.exception("The imported file was not text.")
+            embed = error_embed(e, "The file you attached was not a CSV or TSV file.")
+            await interaction.followup.send(embed=embed)
+            raise
+        rows, rejected = parse_rows(text)
+        database = await database_for(interaction.guild_id)
+        results = database.write_many(
+            [(row.user, row.time, row.course, row.advanced) for row in rows]
+        )
+        await database.flush()
+        accepted = []
+        for row, error in zip(rows, results):
+            if error is None:
+                accepted.append(row)
+            elif isinstance(error, TimeException):
+                rejected.append((row.line, f"slower than the stored time. {error}"))
+            else:
+                rejected.append((row.line, f"could not be saved. {error}"))
+        rejected.sort()
+        logger.info(f"Imported {len(accepted)} times, rejected {len(rejected)} rows.")
+        await interaction.followup.send(embed=import_embed(accepted, rejected))
+
     @app_commands.command()
     async def register(
         self, interaction: discord.Interaction, user: Optional[discord.User] = None
@@ -320,8 +646,10 @@ class MainCog(commands.Cog):
             real_user = interaction.user
         else:
             real_user = user
+        database = await database_for(interaction.guild_id)
         try:
-            self.database.register_user(user=real_user)
+            new_users = database.register_user(user=real_user)
+            await database.flush()
         except TypeError as e:
             logger.exception(
                 "Error while registering user. User was not a User/Member or a list."
@@ -330,18 +658,19 @@ class MainCog(commands.Cog):
                 embed=error_embed(e, "Internal error: User was not an int")
             )
             raise TypeError from e
-        await interaction.response.send_message(
-            embed=success_embed(
-                f"The user {real_user.mention} has been added to the registered users. Their times will now show on the leaderboard."
-            )
-        )
+        if not new_users:
+            description = f"The user {real_user.mention} is already registered. Their times show on the leaderboard."
+        else:
+            description = f"The user {real_user.mention} has been added to the registered users. Their times will now show on the leaderboard."
+        await interaction.response.send_message(embed=success_embed(description))
 
     @app_commands.command()
     @commands.is_owner()
     async def backup(self, interaction: discord.Interaction):
         """Backup the database."""
         date = arrow.now()
-        self.database.backup(date)
+        database = await database_for(interaction.guild_id)
+        await database.writer.submit(database.backup, date)
         await interaction.response.send_message("Database backed up.", ephemeral=True)
 
 
@@ -352,6 +681,16 @@ class Archive(commands.GroupCog, group_name="archive"):
         """Initialize the archive subcommands."""
         pass
 
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:  # type: ignore
+        """Start timing the archive subcommands."""
+        return _command_started(interaction)
+
+    async def cog_app_command_error(
+        self, interaction: discord.Interaction, error: app_commands.AppCommandError
+    ) -> None:
+        """Time the archive subcommands that fail."""
+        _command_finished(interaction, "error")
+
     @app_commands.command()
     async def leaderboard(
         self,
@@ -378,7 +717,8 @@ class Archive(commands.GroupCog, group_name="archive"):
                 )
                 await interaction.response.send_message(embed=embed)
                 raise CourseException from e  # stops command from continuing to run
-        data_path = Path(f"./database_archive/{year}/{month}/database.toml")
+        root = database_file(interaction.guild_id).parent
+        data_path = archive_path(year, month, root)
         if data_path.exists() is False:
             try:
                 raise DateException()
@@ -391,11 +731,9 @@ class Archive(commands.GroupCog, group_name="archive"):
                     )
                 )
                 raise DateException from e  # stops command from continuing to run
-        local_database = Database(data_path)
-        all_times, best_time = local_database.leaderboard(course)
-        registered_users = local_database.get("registered_users")
-        embed = leaderboard_embed(all_times, best_time, registered_users, course)
-        view = Buttons(path=data_path)
+        # a month that isn't cached is parsed, which can take a while
+        month_data = await asyncio.to_thread(open_archive, data_path)
+        embed, view = Buttons.show(month_data, course, month=(year, month))  # type: ignore
         await interaction.response.send_message(embed=embed, view=view)
 
     @app_commands.command()
@@ -415,7 +753,8 @@ class Archive(commands.GroupCog, group_name="archive"):
         """
         if user is None:
             user = interaction.user
-        data_path = Path(f"./database_archive/{year}/{month}/database.toml")
+        root = database_file(interaction.guild_id).parent
+        data_path = archive_path(year, month, root)
         if data_path.exists() is False:
             try:
                 raise DateException()
@@ -428,9 +767,85 @@ class Archive(commands.GroupCog, group_name="archive"):
                     )
                 )
                 raise DateException from e  # stops command from continuing to run
-        embed = stats_embed(user, year, month)
+        # a month that isn't cached is parsed, which can take a while
+        embed = await asyncio.to_thread(stats_embed, user, year, month, root)
         await interaction.response.send_message(embed=embed)
 
+    @app_commands.command()
+    async def alltime(
+        self,
+        interaction: discord.Interaction,
+        course: Optional[int] = 1,
+    ):
+        """Get everyone's best times on a course across every month.
+
+        Args:
+            course (int, optional): The course to look up. Defaults to 1.
+        """
+        await self._history(interaction, course, None, None, "all time")  # type: ignore
+
+    @app_commands.command(name="range")
+    async def range_(
+        self,
+        interaction: discord.Interaction,
+        from_year: int,
+        from_month: int,
+        to_year: int,
+        to_month: int,
+        course: Optional[int] = 1,
+    ):
+        """Get everyone's best times on a course across a range of months.
+
+        Args:
+            from_year (int): The year of the first month.
+            from_month (int): The first month.
+            to_year (int): The year of the last month.
+            to_month (int): The last month.
+            course (int, optional): The course to look up. Defaults to 1.
+        """
+        await self._history(
+            interaction,
+            course,  # type: ignore
+            (from_year, from_month),
+            (to_year, to_month),
+            f"{from_month}/{from_year} to {to_month}/{to_year}",
+        )
+
+    async def _history(
+        self,
+        interaction: discord.Interaction,
+        course: int,
+        first: Optional[tuple[int, int]],
+        last: Optional[tuple[int, int]],
+        period: str,
+    ):
+        if course not in [1, 2, 3, 4, 5, 6, 7]:
+            try:
+                raise CourseException()
+            except CourseException as e:
+                logger.exception("The course given was invalid.")
+                embed = error_embed(
+                    e,
+                    "The course number you gave was not valid. Make sure this is a valid course!\n*Note: This bot does not support the Daily Challenge right now.*\n",
+                )
+                await interaction.response.send_message(embed=embed)
+                raise CourseException from e  # stops command from continuing to run
+        # reading months that aren't summarized yet can take a while
+        await interaction.response.defer(thinking=True)
+        database = await database_for(interaction.guild_id)
+        # the rankings change on the event loop, so read the current month here
+        current = database.leaderboard(course, page_size)
+        places = await asyncio.to_thread(
+            merged_leaderboard,
+            database_file(interaction.guild_id).parent,
+            course,
+            page_size,
+            first,
+            last,
+            current,
+        )
+        await interaction.followup.send(embed=history_embed(places, course, period))
+
 
 if __name__ == "__main__":
     run()
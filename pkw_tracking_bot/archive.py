@@ -0,0 +1,161 @@
+# SPDX-FileCopyrightText: 2023 osfanbuff63
+#
+# SPDX-License-Identifier: Apache-2.0
+"""Read-only access to archived months."""
+
+import threading
+import tomllib
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from .database import next_version
+from .logger import logger
+from .ranking import build_rankings
+from .records import Records
+from .times import CourseTime
+from pathlib import Path
+
+
+class ArchiveMonth:
+    """A month from `database_archive`, parsed once and never written.
+
+    This offers the read side of `Database` (`leaderboard`, `rank`, `get` and
+    `versions`), so it can be used anywhere a database is only read.
+    """
+
+    __slots__ = ("file", "size", "signature", "records", "rankings", "versions")
+
+    def __init__(self, file: Path) -> None:
+        """Load an archived month.
+
+        Args:
+            file (Path): The path to the archived `database.toml`.
+        """
+        self.file = file
+        stat = file.stat()
+        self.size = stat.st_size
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+        with file.open("rb") as _file:
+            self.records = Records.from_document(tomllib.load(_file))
+        self.rankings = build_rankings(self.records)
+        self.versions = {course: next_version() for course in self.rankings}
+
+    def leaderboard(
+        self, course: int, limit: Optional[int] = None, start: int = 0
+    ) -> list[tuple[int, CourseTime, bool]]:
+        """Get the places on a course, fastest first. See `Database.leaderboard`."""
+        return self.rankings[course].top(limit, start)
+
+    def rank(self, user: int, course: int) -> Optional[int]:
+        """Get a user's place on a course. See `Database.rank`."""
+        return self.rankings[course].rank(user)
+
+    def get(self, key: str):
+        """Get a key from the archived month, laid out like `database.toml`."""
+        return self.records[key]
+
+
+class ArchiveCache:
+    """A least recently used cache of archived months, bounded by their file sizes.
+
+    It is shared by the event loop and the threads that build multi-month
+    leaderboards. Months are parsed outside the lock, so a hit never waits for
+    another month to load.
+    """
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024) -> None:
+        """Initialize the cache.
+
+        Args:
+            max_bytes (int, optional): The total size of the archive files to keep parsed. Defaults to 16 MiB.
+        """
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._months: OrderedDict[Path, ArchiveMonth] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file: Path) -> ArchiveMonth:
+        """Get an archived month, loading it if it isn't cached.
+
+        The current month's archive is rewritten by backups, so a cached month is
+        loaded again if its file has changed.
+
+        Args:
+            file (Path): The path to the archived `database.toml`.
+
+        Raises:
+            FileNotFoundError: If the file does not exist.
+
+        Returns:
+            ArchiveMonth: The month.
+        """
+        path = file.resolve()
+        with self._lock:
+            month = self._months.get(path)
+        if month is not None:
+            stat = path.stat()
+            if (stat.st_mtime_ns, stat.st_size) == month.signature:
+                with self._lock:
+                    if path in self._months:
+                        self._months.move_to_end(path)
+                return month
+        month = ArchiveMonth(path)
+        evicted = []
+        with self._lock:
+            if path in self._months:
+                # changed, or loaded by another thread meanwhile
+                self._remove(path)
+            self._months[path] = month
+            self.bytes += month.size
+            while self.bytes > self.max_bytes and len(self._months) > 1:
+                oldest = next(iter(self._months))
+                logger.debug("Evicting %s from the archive cache.", oldest)
+                self._remove(oldest)
+                evicted.append(oldest)
+        for listener in _eviction_listeners:
+            listener(evicted)
+        return month
+
+    def _remove(self, path: Path) -> None:
+        month = self._months.pop(path)
+        self.bytes -= month.size
+
+
+archives = ArchiveCache()
+# called with the files of the months evicted from an archive cache
+_eviction_listeners: list[Callable[[list[Path]], None]] = []
+
+
+def on_evict(listener: Callable[[list[Path]], None]) -> None:
+    """Call a function with the files of archived months evicted from the cache, so what is derived from them can be dropped too.
+
+    Args:
+        listener (Callable[[list[Path]], None]): The function. It may be called from any thread.
+    """
+    _eviction_listeners.append(listener)
+
+
+def open_archive(file: Path | str) -> ArchiveMonth:
+    """Get an archived month from the shared cache.
+
+    Args:
+        file (Path | str): The path to the archived `database.toml`.
+
+    Returns:
+        ArchiveMonth: The month.
+    """
+    return archives.get(Path(file))
+
+
+def archive_path(year: int, month: int, root: Path = Path(".")) -> Path:
+    """Get the path of an archived month's `database.toml`.
+
+    Args:
+        year (int): The year.
+        month (int): The month.
+        root (Path, optional): The folder `database_archive` is in, which is the database's folder. Defaults to the working directory.
+
+    Returns:
+        Path: The path, which may not exist.
+    """
+    return root / "database_archive" / str(year) / str(month) / "database.toml"
@@ -0,0 +1,182 @@
+# SPDX-FileCopyrightText: 2023 osfanbuff63
+#
+# SPDX-License-Identifier: Apache-2.0
+"""Deduplicated backups of the database into `database_archive`."""
+
+import hashlib
+import itertools
+import os
+import shutil
+import threading
+import time
+from typing import Optional
+
+import arrow
+
+from . import _constants
+from .logger import logger
+from .metrics import metrics
+from .times import leaderboard_month
+from pathlib import Path
+
+# back up after this many writes...
+EVERY_WRITES = getattr(_constants, "BACKUP_EVERY_WRITES", 50)
+# ...or once writes are this many seconds old, whichever comes first
+EVERY_SECONDS = getattr(_constants, "BACKUP_EVERY_SECONDS", 600)
+# point-in-time snapshots kept per month
+KEEP_SNAPSHOTS = getattr(_constants, "BACKUP_SNAPSHOTS", 48)
+
+
+class Backups:
+    """Writes backups to `database_archive/YYYY/M/`, skipping unchanged content.
+
+    Every distinct version of the database is stored once, in
+    `database_archive/.objects/<sha256>.toml`. The month's `database.toml` (read
+    by /archive) and its `snapshots/<timestamp>.toml` point-in-time copies are
+    hard links to those objects, so they take no extra space (where hard links
+    aren't supported they are copies). Only the newest `keep` snapshots of a
+    month are kept, and objects no month or snapshot holds anymore are deleted.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        every_writes: int = EVERY_WRITES,
+        every_seconds: float = EVERY_SECONDS,
+        keep: int = KEEP_SNAPSHOTS,
+    ) -> None:
+        """Initialize the backups.
+
+        Args:
+            root (Path): The folder `database_archive` is in.
+            every_writes (int, optional): Back up after this many writes. Defaults to `BACKUP_EVERY_WRITES` from the constants, or 50.
+            every_seconds (float, optional): Back up once writes are this many seconds old. Defaults to `BACKUP_EVERY_SECONDS` from the constants, or 600.
+            keep (int, optional): The number of snapshots to keep per month. Defaults to `BACKUP_SNAPSHOTS` from the constants, or 48.
+        """
+        self.archive = root / "database_archive"
+        self.objects = self.archive / ".objects"
+        self.every_writes = every_writes
+        self.every_seconds = every_seconds
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._last_backup = time.monotonic()
+        # month folder -> digest of its database.toml
+        self._digests: dict[Path, Optional[str]] = {}
+        # (copied file, mtime, size) -> digest, so copies are only hashed once
+        self._copies: dict[tuple[Path, int, int], str] = {}
+
+    def count(self, writes: int) -> None:
+        """Count writes made since the last backup.
+
+        Args:
+            writes (int): The number of writes.
+        """
+        with self._lock:
+            self._writes += writes
+
+    def due(self) -> bool:
+        """Whether the counted writes call for a backup."""
+        with self._lock:
+            return self._writes > 0 and (
+                self._writes >= self.every_writes
+                or time.monotonic() - self._last_backup >= self.every_seconds
+            )
+
+    def write(self, text: str, date: arrow.Arrow) -> Optional[Path]:
+        """Back up the database, unless this month's backup already has the same content.
+
+        Args:
+            text (str): The serialized database.
+            date (arrow.Arrow): The date to file the backup under, in the leaderboard month it belongs to.
+
+        Returns:
+            Optional[Path]: The snapshot that was written, or None if the content was unchanged.
+        """
+        with self._lock:
+            self._writes = 0
+            self._last_backup = time.monotonic()
+            data = text.encode("utf-8")
+            digest = hashlib.sha256(data).hexdigest()
+            year, month = leaderboard_month(date)
+            month_dir = self.archive / str(year) / str(month)
+            current = month_dir / "database.toml"
+            if month_dir not in self._digests:
+                self._digests[month_dir] = (
+                    hashlib.sha256(current.read_bytes()).hexdigest()
+                    if current.exists()
+                    else None
+                )
+            if self._digests[month_dir] == digest:
+                logger.debug("Backup for %s is unchanged, skipping it.", month_dir)
+                return None
+            stored = self._store(digest, data)
+            snapshots = month_dir / "snapshots"
+            snapshots.mkdir(parents=True, exist_ok=True)
+            snapshot = snapshots / f"{date.int_timestamp}.toml"
+            _link(stored, snapshot)
+            # replace rather than write in place, the old file is linked to other snapshots
+            _link(stored, current)
+            self._digests[month_dir] = digest
+            self._prune(snapshots)
+            return snapshot
+
+    def _store(self, digest: str, data: bytes) -> Path:
+        self.objects.mkdir(parents=True, exist_ok=True)
+        stored = self.objects / f"{digest}.toml"
+        if not stored.exists():
+            temporary = stored.with_suffix(".tmp")
+            temporary.write_bytes(data)
+            os.replace(temporary, stored)
+            metrics.increment("pkw_bytes_written_total", len(data), file="backup")
+        return stored
+
+    def _prune(self, snapshots: Path) -> None:
+        old = sorted(snapshots.glob("*.toml"), key=lambda path: int(path.stem))[
+            : -self.keep
+        ]
+        for snapshot in old:
+            snapshot.unlink()
+        referenced = self._referenced()
+        for stored in self.objects.glob("*.toml"):
+            if stored.stem not in referenced:
+                # no month or snapshot holds this version anymore
+                stored.unlink()
+
+    def _referenced(self) -> set[str]:
+        """The digests of the versions held by every month's `database.toml` and snapshots."""
+        # an object and its hard links share an inode
+        objects = {}
+        for stored in self.objects.glob("*.toml"):
+            stat = stored.stat()
+            objects[stat.st_dev, stat.st_ino] = stored.stem
+        referenced = set()
+        copies = {}
+        for file in itertools.chain(
+            self.archive.glob("*/*/database.toml"),
+            self.archive.glob("*/*/snapshots/*.toml"),
+        ):
+            stat = file.stat()
+            digest = objects.get((stat.st_dev, stat.st_ino))
+            if digest is None:
+                # a copy, made where hard links aren't supported
+                key = (file, stat.st_mtime_ns, stat.st_size)
+                digest = self._copies.get(key)
+                if digest is None:
+                    digest = hashlib.sha256(file.read_bytes()).hexdigest()
+                copies[key] = digest
+            referenced.add(digest)
+        # forget the copies that were pruned
+        self._copies = copies
+        return referenced
+
+
+def _link(source: Path, destination: Path) -> None:
+    """Atomically make `destination` a hard link to `source`, copying if links are unsupported."""
+    temporary = destination.with_name(f"{destination.name}.tmp")
+    temporary.unlink(missing_ok=True)
+    try:
+        os.link(source, temporary)
+    except OSError:
+        shutil.copyfile(source, temporary)
+    os.replace(temporary, destination)
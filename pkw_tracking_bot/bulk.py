@@ -0,0 +1,77 @@
+# SPDX-FileCopyrightText: 2023 osfanbuff63
+#
+# SPDX-License-Identifier: Apache-2.0
+"""Parsing for bulk time imports."""
+
+import csv
+import re
+from typing import NamedTuple
+
+from .exceptions import TimeException
+from .times import CourseTime
+
+MENTION_PATTERN = re.compile(r"<@!?(\d+)>|(\d+)")
+TRUE_VALUES = {"true", "yes", "y", "1", "advanced"}
+FALSE_VALUES = {"false", "no", "n", "0", ""}
+
+
+class ImportRow(NamedTuple):
+    """A valid row of a bulk import."""
+
+    line: int
+    user: int
+    time: CourseTime
+    course: int
+    advanced: bool
+
+
+def parse_rows(text: str) -> tuple[list[ImportRow], list[tuple[int, str]]]:
+    """Parse a CSV or TSV file of `user, course, time, advanced` rows.
+
+    The user can be an ID or a mention, and `advanced` can be left out. A first
+    row that doesn't start with a user (a header) is skipped, as are empty rows.
+
+    Args:
+        text (str): The file's contents.
+
+    Returns:
+        tuple[list[ImportRow], list[tuple[int, str]]]: The valid rows, and the line number and reason of each invalid one.
+    """
+    lines = text.splitlines()
+    delimiter = "\t" if lines and "\t" in lines[0] else ","
+    rows: list[ImportRow] = []
+    rejected: list[tuple[int, str]] = []
+    for line, fields in enumerate(csv.reader(lines, delimiter=delimiter), start=1):
+        fields = [field.strip() for field in fields]
+        if not any(fields):
+            continue
+        user = MENTION_PATTERN.fullmatch(fields[0])
+        if user is None:
+            if line != 1:
+                rejected.append((line, f"{fields[0]!r} is not a user ID or mention."))
+            continue
+        if len(fields) not in (3, 4):
+            rejected.append((line, "Expected user, course, time and advanced."))
+            continue
+        if fields[1] not in {"1", "2", "3", "4", "5", "6", "7"}:
+            rejected.append((line, f"{fields[1]!r} is not a course from 1 to 7."))
+            continue
+        try:
+            time = CourseTime.parse(fields[2])
+        except TimeException as e:
+            rejected.append((line, str(e)))
+            continue
+        advanced = fields[3].lower() if len(fields) == 4 else ""
+        if advanced not in TRUE_VALUES | FALSE_VALUES:
+            rejected.append((line, f"{fields[3]!r} is not true or false."))
+            continue
+        rows.append(
+            ImportRow(
+                line,
+                int(user.group(1) or user.group(2)),
+                time,
+                int(fields[1]),
+                advanced in TRUE_VALUES,
+            )
+        )
+    return rows, rejected
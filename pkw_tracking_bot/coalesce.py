@@ -0,0 +1,80 @@
+# SPDX-FileCopyrightText: 2023 osfanbuff63
+#
+# SPDX-License-Identifier: Apache-2.0
+"""Coalescing of concurrent identical jobs."""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """Runs an async job at most once at a time per key, and skips repeats of a fresh result.
+
+    Callers pass a token describing the result their job would produce (for the
+    leaderboard, the embed it would show). A caller that arrives while a job for
+    its key is running waits for it, and no caller runs a job whose token is the
+    same as the one that finished less than `min_interval` seconds ago.
+    """
+
+    def __init__(self, min_interval: float = 1.0) -> None:
+        """Initialize the coalescer.
+
+        Args:
+            min_interval (float, optional): The number of seconds a finished result stays fresh. Defaults to 1.
+        """
+        self.min_interval = min_interval
+        self._running: dict[Hashable, asyncio.Future] = {}
+        # key -> (when the last job finished, its token)
+        self._finished: dict[Hashable, tuple[float, Any]] = {}
+
+    def pending(self, key: Hashable, token: Any) -> bool:
+        """Whether a job for `key` is running, or one with `token` finished recently.
+
+        A caller for whom this is true will usually not run its job, so it can
+        acknowledge its request before calling `run`.
+        """
+        return key in self._running or self._fresh(key, token)
+
+    def _fresh(self, key: Hashable, token: Any) -> bool:
+        finished = self._finished.get(key)
+        return (
+            finished is not None
+            and finished[1] == token
+            and time.monotonic() - finished[0] < self.min_interval
+        )
+
+    async def run(
+        self, key: Hashable, token: Any, job: Callable[[], Awaitable[Any]]
+    ) -> bool:
+        """Run a job, unless a job with the same key and token has just done the same thing.
+
+        Args:
+            key (Hashable): What the job acts on.
+            token (Any): The result the job would produce, compared with `==`.
+            job (Callable[[], Awaitable[Any]]): The job.
+
+        Returns:
+            bool: Whether the job was run. Exceptions raised by the job are re-raised here.
+        """
+        while (running := self._running.get(key)) is not None:
+            # a failed job is the caller's problem, this one still runs its own
+            await asyncio.wait([running])
+        if self._fresh(key, token):
+            return False
+        future = asyncio.ensure_future(job())
+        self._running[key] = future
+        try:
+            await asyncio.shield(future)
+        finally:
+            del self._running[key]
+        now = time.monotonic()
+        self._finished[key] = (now, token)
+        if len(self._finished) > 256:
+            # forget results that are no longer fresh
+            self._finished = {
+                key: finished
+                for key, finished in self._finished.items()
+                if now - finished[0] < self.min_interval
+            }
+        return True
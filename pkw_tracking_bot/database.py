@@ -3,103 +3,257 @@
 # SPDX-License-Identifier: Apache-2.0
 """The database handler."""
 
-from typing import Optional, Tuple
+import itertools
+import logging
+import threading
+import time
+from typing import Optional
 import arrow
 import discord
-import tomlkit
 
+from .backup import Backups
 from .exceptions import TimeException
 from .logger import logger
+from .metrics import metrics
+from .persistence import GroupCommit, PersistenceWriter, writer as default_writer
+from .ranking import build_rankings
+from .records import COURSES, Records
+from .storage import StorageBackend, backend_for
+from .times import CourseTime, next_reset
 from pathlib import Path
 
+# shared by every database, so a version number is never reused for a path
+_versions = itertools.count()
+
+
+def next_version() -> int:
+    """Get a new leaderboard version number, see `embeds.cached_leaderboard_embed`."""
+    return next(_versions)
+
 
 class Database:
     """An access point to the database."""
 
-    def __init__(self, file: Path | str) -> None:
+    def __init__(
+        self,
+        file: Path | str,
+        writer: Optional[PersistenceWriter] = None,
+        backend: Optional[StorageBackend] = None,
+        backups: Optional[Backups] = None,
+    ) -> None:
         """Initialize the access point to the database.
 
         Args:
             file (Path): The path to the database file.
+            writer (PersistenceWriter, optional): The writer used by `flush`. Defaults to the shared writer.
+            backend (StorageBackend, optional): The storage backend. Defaults to one picked by the file extension.
+            backups (Backups, optional): Where and how often to back up. Defaults to `database_archive` next to the file, with the default cadence.
         """
         if isinstance(file, str):
             self.file = Path(file)
         elif isinstance(file, Path):
             self.file = file
-        if self.file.exists() is False:
-            self.file.write_text("")
+        self.writer = writer if writer is not None else default_writer
+        self.backend = backend if backend is not None else backend_for(self.file)
+        # guards self.records between the event loop and the writer thread
+        self._lock = threading.RLock()
+        # changes made since the last save, in the format described by StorageBackend
+        self._changes: list[tuple] = []
+        # bumped whenever a course's leaderboard could have changed, see embeds.cached_leaderboard_embed
+        self.versions: dict[int, int] = {}
+        self.backups = backups if backups is not None else Backups(self.file.parent)
+        # set while a save is between taking its snapshot and finishing the commit
+        self._committing = False
+        # months replaced by a rollover, archived by the next save on the writer thread
+        self._finished_months: list[tuple[Records, arrow.Arrow]] = []
+        self.submissions = GroupCommit(self)
         self.update_dict()
 
-    def load(self) -> tomlkit.TOMLDocument:
+    def load(self) -> Records:
         """Load the database."""
-        file = Path(self.file).resolve()
-        with file.open() as _file:
-            toml_dict = tomlkit.load(_file)
-        return toml_dict
+        return self.backend.load()
 
     def update_dict(self) -> None:
         """Update the internal database."""
-        toml_dict = self.load()
-        self.toml_doc = toml_dict
+        with metrics.timed("pkw_database_seconds", operation="load"):
+            records = self.load()
+        rankings = build_rankings(records)
+        with self._lock:
+            self._signature = self.backend.signature()
+            self.records = records
+            self.rankings = rankings
+            self._next_reset = _reset_after(records.last_updated)
+            self._bump_versions(*COURSES)
+
+    def reload_if_changed(self) -> bool:
+        """Reload the database if its file was changed by something other than this object.
+
+        Returns:
+            bool: Whether the database was reloaded.
+        """
+        with self._lock:
+            if self._changes or self._committing:
+                # this object's own writes are pending, those win
+                return False
+            if self.backend.signature() == self._signature:
+                return False
+            logger.info(f"{self.file} was changed externally, reloading it.")
+            self.update_dict()
+            return True
+
+    def _bump_versions(self, *courses: int) -> None:
+        for course in courses:
+            self.versions[course] = next_version()
+
+    def save(self, date: Optional[arrow.Arrow] = None) -> None:
+        """Serialize the in-memory database, then write it and its backup to disk.
+
+        This blocks, so on the event loop use `flush` instead.
+
+        Args:
+            date (arrow.Arrow, optional): The date to file the backup under. Defaults to now.
+        """
+        with self._lock:
+            finished = list(self._finished_months)
+        for records, month_date in finished:
+            # archive a month a rollover finished before saving the new one; nothing writes to it anymore
+            self.backup(month_date, records.dumps())
+        with self._lock:
+            del self._finished_months[: len(finished)]
+            if not self._changes and not self.backend.due() and not self.backups.due():
+                return
+            started = time.perf_counter()
+            changes, self._changes = self._changes, []
+            snapshot = self.backend.snapshot(self.records, changes)
+            self._committing = True
+        if date is None:
+            date = arrow.utcnow()
+        try:
+            text = self.backend.commit(snapshot)
+        except Exception:
+            with self._lock:
+                # keep them for the next save, before any made since; applying a change twice is harmless
+                self._changes[:0] = changes
+            raise
+        finally:
+            with self._lock:
+                self._signature = self.backend.signature()
+                self._committing = False
+            metrics.observe(
+                "pkw_database_seconds", time.perf_counter() - started, operation="save"
+            )
+        self.backups.count(len(changes))
+        if self.backups.due():
+            # reuse the document if the backend serialized it anyway
+            self.backup(date, text)
+
+    async def flush(self) -> None:
+        """Persist the in-memory database on the writer thread."""
+        await self.writer.submit(self.save)
 
     def write(
         self,
         user: discord.User | discord.Member,
-        time: str,
+        time: CourseTime,
         course_id: int,
         advanced: bool = False,
     ) -> None:
-        """Write a time to the database.
+        """Write a time to the in-memory database. Call `flush` to persist it.
 
         Args:
             user (discord.User | discord.Member): The Discord user to submit this time for.
-            time (str): The time to submit.
+            time (CourseTime): The time to submit.
             course_id (int): The course to submit this time to.
             advanced (bool, optional): Whether this was an advanced completion. Defaults to False.
 
         Raises:
             TimeException: If the time was slower than the currently stored time.
         """
-        id = user.id
-        utc = arrow.utcnow()
-        current_time = utc.to("US/Eastern")
-        try:
-            written_time = arrow.get(self.toml_doc["last_updated"])  # type: ignore
-        except:
-            written_time = None
-        if written_time is not None:
-            # ignore type checking because written_time cannot be None here
-            if current_time.date().month != written_time.date().month:  # type: ignore
-                # new month, reset the times
-                logger.info("A new month was detected, resetting all times.")
-                self._overwrite(current_time)
-        try:
-            if (
-                self.toml_doc[f"{id}"][f"course_{course_id}"]["time"] < time  # type: ignore
-                or self.toml_doc[f"{id}"][f"course_{course_id}"]["time"] == ""  # type: ignore
-            ):
-                raise TimeException()
-        except KeyError:
+        with self._lock:
+            self._write(
+                user.id, time, course_id, advanced, arrow.utcnow().int_timestamp
+            )
+
+    async def submit(
+        self, user: int, time: CourseTime, course_id: int, advanced: bool = False
+    ) -> Optional[TimeException]:
+        """Write a time and persist it, together with other times submitted at the same moment.
+
+        Args:
+            user (int): The ID of the user to submit this time for.
+            time (CourseTime): The time to submit.
+            course_id (int): The course to submit this time to.
+            advanced (bool, optional): Whether this was an advanced completion. Defaults to False.
+
+        Returns:
+            Optional[TimeException]: None once the time is persisted, or the exception if it was slower than the stored time.
+        """
+        return await self.submissions.submit((user, time, course_id, advanced))
+
+    def write_many(
+        self, entries: list[tuple[int, CourseTime, int, bool]]
+    ) -> list[Optional[Exception]]:
+        """Write many times to the in-memory database at once. Call `flush` to persist them.
+
+        The times are applied in order, each against the best time stored at that
+        point, and all of them are persisted by the same flush. An entry that
+        fails doesn't stop the others.
+
+        Args:
+            entries (list[tuple[int, CourseTime, int, bool]]): The user ID, time, course and advanced flag of each time.
+
+        Returns:
+            list[Optional[Exception]]: For each entry, None if it was written, or the exception if it wasn't: a TimeException if it was slower than the stored time.
+        """
+        timestamp = arrow.utcnow().int_timestamp
+        results: list[Optional[Exception]] = []
+        with self._lock:
+            for id, course_time, course_id, advanced in entries:
+                try:
+                    self._write(id, course_time, course_id, advanced, timestamp)
+                except TimeException as e:
+                    results.append(e)
+                except Exception as e:
+                    logger.exception(f"Could not write a time for {id}.")
+                    results.append(e)
+                else:
+                    results.append(None)
+        return results
+
+    def _write(
+        self,
+        id: int,
+        time: CourseTime,
+        course_id: int,
+        advanced: bool,
+        timestamp: int,
+    ) -> None:
+        self._roll_over_before(timestamp)
+        if id not in self.records:
             logger.error(
                 "User did not exist for given course, assuming the time is newer."
             )
-            self.register_user(user)
-        self.toml_doc[f"{id}"][f"course_{course_id}"]["time"] = time  # type: ignore
-        self.toml_doc[f"{id}"][f"course_{course_id}"]["advanced"] = advanced  # type: ignore
-        # logger.debug(f"self.toml_doc: {self.toml_doc.as_string()}")
-        current_timestamp = current_time.int_timestamp
-        # make backup
-        self.backup(current_time)
-        self.toml_doc["last_updated"] = current_timestamp
-        self.file.write_text(self.toml_doc.as_string().rstrip())
-        self.update_dict()
+            self._register_user(None, [id])
+        else:
+            stored = self.records.get(id, course_id)
+            if stored is not None and stored[0] < time:
+                raise TimeException(f"The stored time is {stored[0]}.")
+        self.records.set(id, course_id, time, advanced)
+        self.rankings[course_id].update(id, time, advanced)
+        self._bump_versions(course_id)
+        self.records.last_updated = timestamp
+        self._changes.append(
+            ("time", id, course_id, time.centiseconds, advanced, timestamp)
+        )
 
     def register_user(
         self,
         user: Optional[discord.User | discord.Member] = None,
         users: Optional[list[int | str]] = None,
-    ):
-        """Register a user or group of users to be in the database.
+    ) -> list[int]:
+        """Register a user or group of users in the in-memory database. Call `flush` to persist it.
+
+        Users who are already registered are skipped, so registering is safe to repeat.
 
         Args:
             user (Optional[discord.User  |  discord.Member], optional): The Discord user to register. **Only one** of `user` and `users` can be specified. Defaults to None.
@@ -107,130 +261,248 @@ class Database:
 
         Raises:
             TypeError: If more than one or neither of `user` and `users` is specified.
+
+        Returns:
+            list[int]: The IDs that were newly registered.
         """
         if user and users:
             raise TypeError("User and users cannot both be defined.")
         if user is None and users is None:
             raise TypeError("One of user and users must be defined.")
+        with self._lock:
+            return self._register_user(user, users)
 
-        registered_users = []
-        try:
-            if self.toml_doc["registered_users"] != []:
-                for id in self.toml_doc["registered_users"]:  # type: ignore
-                    registered_users.append(id)
-        except KeyError:
-            logger.debug("KeyError on registered_users, continuing")
-        user_already_registered = False
-        try:
-            for registered_user in self.toml_doc["registered_users"]:  # type: ignore
-                if registered_user == id:
-                    user_already_registered = True
-                    break
-                else:
-                    continue
-        except KeyError:
-            # registered_users didn't exist, likely the database just reset
-            pass
-        if user_already_registered is False:
-            if isinstance(user, discord.User):
-                id = user.id
-                registered_users.append(id)
-            elif isinstance(user, discord.Member):
-                id = user.id
-                registered_users.append(id)
-            elif users:
-                for id in users:
-                    registered_users.append(id)
-            else:
-                logger.debug(f"User: {user}")
-                raise TypeError("User was not a list or a discord User.")
-            table = tomlkit.table()
-            table.append(tomlkit.key(["course_1", "time"]), "99:99.99")
-            table.append(tomlkit.key(["course_1", "advanced"]), False)
-
-            table.append(tomlkit.key(["course_2", "time"]), "99:99.99")
-            table.append(tomlkit.key(["course_2", "advanced"]), False)
-
-            table.append(tomlkit.key(["course_3", "time"]), "99:99.99")
-            table.append(tomlkit.key(["course_3", "advanced"]), False)
-
-            table.append(tomlkit.key(["course_4", "time"]), "99:99.99")
-            table.append(tomlkit.key(["course_4", "advanced"]), False)
-
-            table.append(tomlkit.key(["course_5", "time"]), "99:99.99")
-            table.append(tomlkit.key(["course_5", "advanced"]), False)
-
-            table.append(tomlkit.key(["course_6", "time"]), "99:99.99")
-            table.append(tomlkit.key(["course_6", "advanced"]), False)
-
-            table.append(tomlkit.key(["course_7", "time"]), "99:99.99")
-            table.append(tomlkit.key(["course_7", "advanced"]), False)
-            self.toml_doc.append(str(id), table)
-        logger.debug(f"registered_users: {str(registered_users)}")
-        # make backup
-        date = arrow.get()
-        self.backup(date)
-        current_timestamp = date.int_timestamp
-        self.toml_doc["registered_users"] = registered_users
-        self.toml_doc["last_updated"] = current_timestamp
-        self.file.write_text(self.toml_doc.as_string().replace("\\n", ""))
-        self.update_dict()
+    def _register_user(
+        self,
+        user: Optional[discord.User | discord.Member],
+        users: Optional[list[int | str]],
+    ) -> list[int]:
+        if isinstance(user, discord.User) or isinstance(user, discord.Member):
+            ids = [user.id]
+        elif users:
+            ids = list(users)
+        else:
+            logger.debug("User: %s", user)
+            raise TypeError("User was not a list or a discord User.")
+        timestamp = arrow.get().int_timestamp
+        self._roll_over_before(timestamp)
+        new_users = self.records.add_users(ids)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("newly registered users: %s", new_users)
+        if new_users:
+            # registering adds no times, so the leaderboards are unchanged
+            self.records.last_updated = timestamp
+            self._changes.append(("register", new_users, timestamp))
+        return new_users
+
+    def backup(self, date: arrow.Arrow, text: Optional[str] = None) -> Optional[Path]:
+        """Backup the database now, unless the month's backup already has the same content.
 
-    def backup(self, date: arrow.Arrow):
-        """Backup the database."""
+        Args:
+            date (arrow.Arrow): The date to file the backup under.
+            text (str, optional): The already serialized database. Defaults to serializing the in-memory database.
+
+        Returns:
+            Optional[Path]: The snapshot that was written, or None if nothing changed.
+        """
         # copy the current database to the archive folder so it can be viewed via /archive
         # and in case it breaks, we have a backup
-        datetime = date.date()
-        file_dir = str(self.file).strip(self.file.name)
-        archive_path = Path(
-            file_dir,
-            f"database_archive/{datetime.year}/{datetime.month}/database.toml",
-        )
-        if not archive_path.exists():
-            archive_path_dir = Path(
-                file_dir, f"database_archive/{datetime.year}/{datetime.month}/"
-            )
-            archive_path_dir.mkdir(parents=True, exist_ok=True)
-            archive_path.touch(exist_ok=True)
-        archive_path.write_text(self.file.read_text())
+        with metrics.timed("pkw_database_seconds", operation="backup"):
+            if text is None:
+                with self._lock:
+                    records = self.records.copy()
+                text = records.dumps()
+            return self.backups.write(text, date)
+
+    def needs_rollover(self, now: Optional[arrow.Arrow] = None) -> bool:
+        """Whether the stored times are from an earlier leaderboard month.
+
+        Args:
+            now (arrow.Arrow, optional): The current time. Defaults to now.
+        """
+        if self._next_reset is None:
+            return False
+        if now is None:
+            now = arrow.utcnow()
+        return now.int_timestamp >= self._next_reset
+
+    def rollover(self, now: Optional[arrow.Arrow] = None) -> bool:
+        """Archive the finished month and start a new one, if the courses have reset.
+
+        This blocks, so on the event loop run it on the writer
+        (`await database.writer.submit(database.rollover)`).
+
+        Args:
+            now (arrow.Arrow, optional): The current time. Defaults to now.
+
+        Returns:
+            bool: Whether a new month was started.
+        """
+        if now is None:
+            now = arrow.utcnow()
+        if not self.needs_rollover(now):
+            return False
+        logger.info("A new month has started, resetting all times.")
+        with metrics.timed("pkw_database_seconds", operation="rollover"):
+            self._overwrite(now)
+            self.save(now)
+        return True
+
+    def _roll_over_before(self, timestamp: int) -> None:
+        # a change made after the courses reset but before roll_over_month runs
+        # starts the new month itself; otherwise the old month's times would carry over
+        if self._next_reset is None:
+            # the first change of a new database starts its month
+            self._next_reset = _reset_after(timestamp)
+        elif timestamp >= self._next_reset:
+            logger.info("A new month has started, resetting all times.")
+            self._overwrite(arrow.get(timestamp))
 
     def _overwrite(self, date: arrow.Arrow) -> None:
-        registered_users = []
-        try:
-            for user in self.toml_doc["registered_users"]:  # type: ignore
-                registered_users.append(user)
-        except KeyError:
-            pass
-        # make backup
-        self.backup(date)
-        self.file.write_text(f"last_updated = {date.int_timestamp}")
-        self.update_dict()
-        if registered_users != []:
-            self.register_user(users=registered_users)
+        # the finished month is archived by the next save, on the writer thread
+        # build the new month before taking the lock, so writes only wait for the swap
+        registered_users = list(self.records.users)
+        records = Records()
+        records.last_updated = date.int_timestamp
+        records.add_users(registered_users)
+        rankings = build_rankings(records)
+        with self._lock:
+            old_records = self.records
+            # users registered while the new month was being built
+            late_users = old_records.users[len(registered_users) :]
+            self.records = records
+            self.rankings = rankings
+            self._next_reset = _reset_after(records.last_updated)
+            self._bump_versions(*COURSES)
+            self._changes.append(("reset", date.int_timestamp))
+            if registered_users:
+                self._changes.append(("register", registered_users, date.int_timestamp))
+            if late_users:
+                self._register_user(None, late_users)
+            last_updated = old_records.last_updated
+            self._finished_months.append(
+                (
+                    old_records,
+                    arrow.get(last_updated) if last_updated is not None else date,
+                )
+            )
 
-    def leaderboard(self, course: int) -> Tuple[dict, str]:
+    def leaderboard(
+        self, course: int, limit: Optional[int] = None, start: int = 0
+    ) -> list[tuple[int, CourseTime, bool]]:
         """Get the statistics needed for the leaderboard command.
 
         Args:
-            course (int): The course to get the statistics for,
+            course (int): The course to get the statistics for.
+            limit (int, optional): The number of places to return. Defaults to all of them.
+            start (int, optional): The number of places to skip. Defaults to 0.
 
         Returns:
-            Tuple[dict, str]: All the times, and the best time.
+            list[tuple[int, CourseTime, bool]]: The user ID, time and advanced flag of each place, fastest first.
         """
-        current_state = self.load()
-        registered_users = current_state.get("registered_users")
-        logger.debug(f"Registered users (database): {registered_users}")
-        times = {}
-        for user in registered_users:  # type: ignore
-            times[user] = current_state[f"{user}"][f"course_{course}"]["time"]  # type: ignore
-            if current_state[f"{user}"][f"course_{course}"]["advanced"]:  # type: ignore
-                str_times_user = str(times[user])
-                logger.debug(f"str_times_user: {str_times_user}")
-                times[user] = str_times_user + " [Advanced Completion]"
-                logger.debug(f"times[user]: {times[user]}")
-        best_time = min(times.values())  # type: ignore
-        return times, best_time  # type: ignore
+        return self.rankings[course].top(limit, start)
+
+    def rank(self, user: int, course: int) -> Optional[int]:
+        """Get a user's place on a course.
+
+        Args:
+            user (int): The user's ID.
+            course (int): The course.
+
+        Returns:
+            Optional[int]: The place, starting at 1, or None if the user has no time on this course.
+        """
+        return self.rankings[course].rank(user)
 
     def get(self, key: str):
-        """Get a key from the database file."""
-        return self.toml_doc[key]
+        """Get a key from the database, laid out like `database.toml`."""
+        with self._lock:
+            return self.records[key]
+
+
+def _reset_after(timestamp: Optional[int]) -> Optional[int]:
+    """When the month of a timestamp ends, or None for a database nothing was written to."""
+    if timestamp is None:
+        return None
+    return next_reset(arrow.get(timestamp)).int_timestamp
+
+
+_databases: dict[Path, Database] = {}
+# path -> when it was last opened, from time.monotonic
+_last_used: dict[Path, float] = {}
+_databases_lock = threading.Lock()
+
+
+def open_database(file: Path | str) -> Database:
+    """Get the shared database for a file, opening it the first time.
+
+    Every caller asking for the same file gets the same object, so they all see
+    each other's writes. If the file was changed by something else since it was
+    last read, it is reloaded first. Opening a database for the first time
+    blocks while it is loaded, see `is_open`.
+
+    Args:
+        file (Path | str): The path to the database file.
+
+    Returns:
+        Database: The database.
+    """
+    path = Path(file).resolve()
+    with _databases_lock:
+        _last_used[path] = time.monotonic()
+        database = _databases.get(path)
+        if database is None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            database = _databases[path] = Database(path)
+            return database
+    database.reload_if_changed()
+    return database
+
+
+def is_open(file: Path | str) -> bool:
+    """Whether the database for a file is already loaded."""
+    return Path(file).resolve() in _databases
+
+
+def open_databases() -> list[Database]:
+    """Get every database that is loaded."""
+    with _databases_lock:
+        return list(_databases.values())
+
+
+def close_idle_databases(
+    max_idle: float, keep: Optional[Path | str] = None
+) -> list[Path]:
+    """Save and unload the databases that haven't been opened for a while.
+
+    This blocks, so on the event loop run it on the writer.
+
+    Args:
+        max_idle (float): The number of seconds a database must have been unused for.
+        keep (Path | str, optional): A database file to keep loaded however long it is unused, like the one shared by every guild. Defaults to None.
+
+    Returns:
+        list[Path]: The files of the databases that were unloaded.
+    """
+    kept = Path(keep).resolve() if keep is not None else None
+    closed = []
+    for database in open_databases():
+        path = database.file
+        if path == kept:
+            continue
+        if time.monotonic() - _last_used.get(path, 0) < max_idle:
+            continue
+        database.save()
+        with _databases_lock:
+            # it may have been opened again while saving
+            if time.monotonic() - _last_used.get(path, 0) < max_idle:
+                continue
+            if database._changes or database._committing or database._finished_months:
+                continue
+            del _databases[path]
+            del _last_used[path]
+        database.backend.close()
+        closed.append(path)
+    if closed:
+        logger.info(f"Unloaded {len(closed)} idle databases.")
+    return closed
@@ -3,16 +3,29 @@
 # SPDX-License-Identifier: Apache-2.0
 """The embed constructors."""
 
+import logging
 from typing import Optional
 
-import arrow
 from discord import Embed, User, Member
 
+from .archive import ArchiveMonth, archive_path, on_evict, open_archive
+from .bulk import ImportRow
 from .database import Database
 from .logger import logger
+from .metrics import Metrics
+from .times import CourseTime, next_reset
 from pathlib import Path
 
-database = Database(Path("database.toml"))
+# Discord rejects embed descriptions longer than this
+DESCRIPTION_LIMIT = 4096
+# places per leaderboard page, a page of the longest lines stays within DESCRIPTION_LIMIT
+PAGE_SIZE = 10
+MAX_PAGE_SIZE = 40
+
+# (database path, course, page, page size) -> ((course version, reset timestamp), embed)
+_leaderboard_embeds: dict[
+    tuple[Path, int, int, int], tuple[tuple[int, int], Embed]
+] = {}
 
 
 def error_embed(error, extra_info: Optional[str]) -> Embed:
@@ -54,94 +67,229 @@ def success_embed(description: str) -> Embed:
     return embed
 
 
+def format_time(time: CourseTime, advanced: bool = False) -> str:
+    """Format a time for display.
+
+    Args:
+        time (CourseTime): The time.
+        advanced (bool, optional): Whether it was an advanced completion. Defaults to False.
+
+    Returns:
+        str: The time, like `1:23.45` or `1:23.45 [Advanced Completion]`.
+    """
+    if advanced:
+        return f"{time} [Advanced Completion]"
+    return str(time)
+
+
 def leaderboard_embed(
-    all_times: dict, best_time: str, registered_users: list, course: int
+    places: list[tuple[int, CourseTime, bool]],
+    course: int,
+    page: int = 0,
+    page_size: int = PAGE_SIZE,
+    total: Optional[int] = None,
 ) -> Embed:
     """The leaderboard embed.
 
     Args:
-        all_times (dict): All the times to display.
-        best_time (str): The best time.
-        registered_users (list): All the registered users.
+        places (list): The user ID, time and advanced flag of the places on this page, fastest first, as returned by `Database.leaderboard`.
         course (int): The course for all the data above.
+        page (int, optional): The page, starting at 0. Defaults to 0.
+        page_size (int, optional): The number of places on a page. Defaults to `PAGE_SIZE`.
+        total (int, optional): The number of places on the whole leaderboard, to show the page count. Defaults to not showing it.
 
     Returns:
         Embed: The embed.
     """
-    all_times_1 = all_times.copy()
-    registered_users_1 = registered_users.copy()
-    logger.debug(f"All times: {str(all_times)}")
-    logger.debug(f"Registered users (embeds): {registered_users}")
-    users = 0
-    for user in registered_users_1:
-        if all_times[user] == best_time and all_times[user] != "99:99.99":
-            best_time_user = user
-            registered_users_1.remove(user)
-            all_times_1.pop(user)
-            logger.debug(f"First place user: {user}")
-            logger.debug(f"Current all times (1): {str(all_times)}")
-            logger.debug(f"Current registered users (1): {str(registered_users_1)}")
-            second_best_time = min(all_times_1.values())
-            users += 1
-        else:
-            continue
-    try:
-        for user in registered_users_1:
-            if all_times[user] == second_best_time and all_times[user] != "99:99.99":
-                second_best_time_user = user
-                registered_users_1.remove(user)
-                all_times_1.pop(user)
-                logger.debug(f"Second place user: {user}")
-                logger.debug(f"Current all times (2): {str(all_times)}")
-                users += 1
-            else:
-                if all_times[user] != "99:99.99":
-                    third_best_time_user = user
-                    users += 1
-                continue
-    except UnboundLocalError:
-        logger.exception("Caught UnboundLocalError!")
-    now = arrow.now(tz="America/New_York")
-    timestamp = arrow.get(
-        now.year if now.month < 12 else now.year + 1,
-        now.month + 1 if now.month < 12 else 1,
-        1,
-        10,
-        0,
-        0,
-    ).int_timestamp
-    # convert timestamp to an int because Discord doesn't accept decimal times
-    description = f"**Courses reset <t:{timestamp}:R>.**\n\n"
-    if users == 0:
-        description += "*No times have been submitted on this course yet.*"
-    else:
-        description += f"1. <@{best_time_user}>: **{all_times[best_time_user]}**\n"
-        try:
-            if isinstance(second_best_time_user, int):
-                description += f"2. <@{second_best_time_user}>: **{all_times[second_best_time_user]}**\n"
-            if isinstance(third_best_time_user, int):
-                description += (
-                    f"3. <@{third_best_time_user}>: {all_times[third_best_time_user]}"
-                )
-        except UnboundLocalError:
-            logger.exception("Caught UnboundLocalError.")
-            pass
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Places: %s", places)
+    description = f"**Courses reset <t:{next_reset().int_timestamp}:R>.**\n\n"
+    description += _place_lines(places[:page_size], page * page_size + 1, description)
     embed = Embed(
         color=65280,
         type="rich",
-        description=description,
+        description=description.rstrip("\n"),
         title=f"Leaderboard for Course {course}",
     )
+    if total is not None:
+        embed.set_footer(text=f"Page {page + 1} of {page_count(total, page_size)}")
+    return embed
+
+
+def history_embed(
+    places: list[tuple[int, CourseTime, bool]], course: int, period: str
+) -> Embed:
+    """The leaderboard embed for several months, with each user's best time.
+
+    Args:
+        places (list): The user ID, time and advanced flag of the top places, fastest first, as returned by `history.merged_leaderboard`.
+        course (int): The course for all the data above.
+        period (str): The months covered, like `all time` or `1/2024 to 12/2024`.
+
+    Returns:
+        Embed: The embed.
+    """
+    description = _place_lines(places, 1)
+    embed = Embed(
+        color=65280,
+        type="rich",
+        description=description.rstrip("\n"),
+        title=f"Leaderboard for Course {course}, {period}",
+    )
     return embed
 
 
-def stats_embed(user: User | Member, year: int, month: int) -> Embed:
+def _place_lines(
+    places: list[tuple[int, CourseTime, bool]], first: int, before: str = ""
+) -> str:
+    """Format places, one per line, staying within the description limit after `before`."""
+    if not places:
+        return "*No times have been submitted on this course yet.*"
+    lines = ""
+    for place, (user, time, advanced) in enumerate(places, start=first):
+        time = format_time(time, advanced)
+        # the top two are bold
+        line = (
+            f"{place}. <@{user}>: **{time}**\n"
+            if place < 3
+            else f"{place}. <@{user}>: {time}\n"
+        )
+        if len(before) + len(lines) + len(line) > DESCRIPTION_LIMIT:
+            break
+        lines += line
+    return lines
+
+
+def page_count(total: int, page_size: int) -> int:
+    """The number of pages a leaderboard of `total` places takes, at least 1."""
+    return max(1, -(-total // page_size))
+
+
+def import_embed(accepted: list[ImportRow], rejected: list[tuple[int, str]]) -> Embed:
+    """The result of a bulk import.
+
+    Args:
+        accepted (list[ImportRow]): The rows that were written.
+        rejected (list[tuple[int, str]]): The line number and reason of each row that wasn't.
+
+    Returns:
+        Embed: The embed.
+    """
+    lines = [f"**{len(accepted)} accepted, {len(rejected)} rejected.**"]
+    lines += [
+        f"Line {row.line}: <@{row.user}> Course {row.course}: {format_time(row.time, row.advanced)}"
+        for row in accepted
+    ]
+    lines += [f"Line {line}: rejected, {reason}" for line, reason in rejected]
+    description = ""
+    for shown, line in enumerate(lines):
+        # stay within Discord's description limit
+        if len(description) + len(line) > DESCRIPTION_LIMIT - 96:
+            description += f"*...and {len(lines) - shown} more.*"
+            break
+        description += line + "\n"
+    embed = Embed(
+        color=65280 if not rejected else 16753920,
+        type="rich",
+        title="Import",
+        description=description,
+    )
+    return embed
+
+
+def metrics_embed(metrics: Metrics) -> Embed:
+    """An embed summarizing the recorded latencies and bytes written, for /metrics.
+
+    Quantiles are the upper bounds of the histogram buckets they fall in.
+
+    Args:
+        metrics (Metrics): The metrics.
+
+    Returns:
+        Embed: The embed.
+    """
+    histograms, counters = metrics.snapshot()
+    description = ""
+    for name, series in sorted(histograms.items()):
+        description += f"**{name}**\n"
+        for key, histogram in sorted(series.items()):
+            labels = " ".join(value for _, value in key)
+            description += (
+                f"{labels}: {histogram.count}x, mean {histogram.sum / histogram.count * 1000:.1f} ms, "
+                f"p50 ≤ {histogram.quantile(0.5) * 1000:g} ms, p99 ≤ {histogram.quantile(0.99) * 1000:g} ms\n"
+            )
+    for name, series in sorted(counters.items()):
+        description += f"**{name}**\n"
+        for key, value in sorted(series.items()):
+            description += f"{' '.join(value for _, value in key)}: {value:g}\n"
+    if len(description) > DESCRIPTION_LIMIT:
+        description = description[: DESCRIPTION_LIMIT - 1] + "…"
+    embed = Embed(
+        color=65280,
+        type="rich",
+        title="Metrics",
+        description=description or "*Nothing has been recorded yet.*",
+    )
+    return embed
+
+
+def cached_leaderboard_embed(
+    database: Database | ArchiveMonth,
+    course: int,
+    page: int = 0,
+    page_size: int = PAGE_SIZE,
+) -> Embed:
+    """A page of the leaderboard embed for a database, reused until that course changes.
+
+    Args:
+        database (Database | ArchiveMonth): The database or archived month to show.
+        course (int): The course to show.
+        page (int, optional): The page, starting at 0. Pages past the end show the last one. Defaults to 0.
+        page_size (int, optional): The number of places on a page. Defaults to `PAGE_SIZE`.
+
+    Returns:
+        Embed: The embed.
+    """
+    total = len(database.rankings[course])
+    page = min(max(page, 0), page_count(total, page_size) - 1)
+    key = (database.file, course, page, page_size)
+    version = (database.versions[course], next_reset().int_timestamp)
+    cached = _leaderboard_embeds.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    places = database.leaderboard(course, page_size, page * page_size)
+    embed = leaderboard_embed(places, course, page, page_size, total)
+    _leaderboard_embeds[key] = (version, embed)
+    return embed
+
+
+def forget_leaderboard_embeds(files: list[Path]) -> None:
+    """Drop the cached leaderboard embeds of databases that were unloaded, or archived months that were evicted.
+
+    Args:
+        files (list[Path]): The database files.
+    """
+    if not files:
+        return
+    forgotten = set(files)
+    # archived months can be evicted from a worker thread, so iterate over a copy
+    for key in [key for key in list(_leaderboard_embeds) if key[0] in forgotten]:
+        _leaderboard_embeds.pop(key, None)
+
+
+on_evict(forget_leaderboard_embeds)
+
+
+def stats_embed(
+    user: User | Member, year: int, month: int, root: Path = Path(".")
+) -> Embed:
     """Get the stats for the archive viewer.
 
     Args:
         user (User | Member): The user to look up.
         year (int): The year to look up.
         month (int): The month to look up.
+        root (Path, optional): The folder `database_archive` is in. Defaults to the working directory.
 
     Returns:
         Embed: The embed.
@@ -172,24 +320,17 @@ def stats_embed(user: User | Member, year: int, month: int) -> Embed:
         "08": "August",
         "09": "September",
     }
-    database = Database(Path(f"./database_archive/{year}/{month}/database.toml"))
+    database = open_archive(archive_path(year, month, root))
     stats = database.get(str(id))
-    logger.debug(f"stats: {stats}")
+    logger.debug("stats: %s", stats)
     text = f"### Stats for <@{id}> in {months[f"{month}"]} {year}\n\n"
-    text += f"**Course 1**: {stats["course_1"].get("time") if stats["course_1"].get("time") != "99:99.99" else "*No time submitted*"}"
-    text += f"{" (Advanced Completion)" if stats["course_1"].get("advanced") else ""}\n"
-    text += f"**Course 2**: {stats["course_2"].get("time") if stats["course_2"].get("time") != "99:99.99" else "*No time submitted*"}"
-    text += f"{" (Advanced Completion)" if stats["course_2"].get("advanced") else ""}\n"
-    text += f"**Course 3**: {stats["course_3"].get("time") if stats["course_3"].get("time") != "99:99.99" else "*No time submitted*"}"
-    text += f"{" (Advanced Completion)" if stats["course_3"].get("advanced") else ""}\n"
-    text += f"**Course 4**: {stats["course_4"].get("time") if stats["course_4"].get("time") != "99:99.99" else "*No time submitted*"}"
-    text += f"{" (Advanced Completion)" if stats["course_4"].get("advanced") else ""}\n"
-    text += f"**Course 5**: {stats["course_5"].get("time") if stats["course_5"].get("time") != "99:99.99" else "*No time submitted*"}"
-    text += f"{" (Advanced Completion)" if stats["course_5"].get("advanced") else ""}\n"
-    text += f"**Course 6**: {stats["course_6"].get("time") if stats["course_6"].get("time") != "99:99.99" else "*No time submitted*"}"
-    text += f"{" (Advanced Completion)" if stats["course_6"].get("advanced") else ""}\n"
-    text += f"**Course 7**: {stats["course_7"].get("time") if stats["course_7"].get("time") != "99:99.99" else "*No time submitted*"}"
-    text += f"{" (Advanced Completion)" if stats["course_7"].get("advanced") else ""}\n"
+    for course in range(1, 8):
+        time = CourseTime.from_stored(stats[f"course_{course}"].get("time"))
+        if time is None:
+            text += f"**Course {course}**: *No time submitted*\n"
+        else:
+            text += f"**Course {course}**: {time}"
+            text += f"{" (Advanced Completion)" if stats[f"course_{course}"].get("advanced") else ""}\n"
     embed = Embed(
         color=65280,
         type="rich",
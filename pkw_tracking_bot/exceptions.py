@@ -24,3 +24,7 @@ class DiscordLibException(discord_errors.DiscordException):
 
 class DateException(Exception):
     """The year and month combination did not have a database file."""
+
+
+class OwnerException(Exception):
+    """The command can only be used by the owner of the bot."""
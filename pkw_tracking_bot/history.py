@@ -0,0 +1,173 @@
+# SPDX-FileCopyrightText: 2023 osfanbuff63
+#
+# SPDX-License-Identifier: Apache-2.0
+"""Leaderboards spanning several months."""
+
+import heapq
+import json
+import os
+from typing import Iterable, Optional
+
+from .archive import open_archive
+from .logger import logger
+from .times import CourseTime, leaderboard_month
+from pathlib import Path
+
+# places kept in each month's summary, larger leaderboards read the whole month
+SUMMARY_SIZE = 100
+SUMMARY_NAME = "top.json"
+
+Place = tuple[int, CourseTime, bool]
+
+# month file -> (file signature, course -> top places)
+_summaries: dict[Path, tuple[tuple[int, int, int], dict[int, list[Place]]]] = {}
+
+
+def archived_months(root: Path) -> list[tuple[int, int, Path]]:
+    """List the archived months, oldest first.
+
+    Args:
+        root (Path): The folder `database_archive` is in.
+
+    Returns:
+        list[tuple[int, int, Path]]: The year, month and `database.toml` of each month.
+    """
+    months = []
+    for file in root.glob("database_archive/*/*/database.toml"):
+        try:
+            months.append((int(file.parent.parent.name), int(file.parent.name), file))
+        except ValueError:
+            continue
+    return sorted(months)
+
+
+def month_top(file: Path, course: int, limit: int) -> list[Place]:
+    """Get the fastest places of an archived month.
+
+    Up to `SUMMARY_SIZE` places are read from the month's summary, which is
+    written next to it the first time it is needed and rebuilt whenever the
+    month's file changes, so the month itself is only parsed once.
+
+    Args:
+        file (Path): The month's `database.toml`.
+        course (int): The course.
+        limit (int): The number of places.
+
+    Returns:
+        list[Place]: The user ID, time and advanced flag of each place, fastest first.
+    """
+    if limit > SUMMARY_SIZE:
+        return open_archive(file).leaderboard(course, limit)
+    return _summary(file)[course][:limit]
+
+
+def _summary(file: Path) -> dict[int, list[Place]]:
+    stat = file.stat()
+    # backups replace the file with a hard link to another version, so the inode identifies the version
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    cached = _summaries.get(file)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    summary_file = file.with_name(SUMMARY_NAME)
+    try:
+        data = json.loads(summary_file.read_text())
+        if tuple(data["signature"]) != signature:
+            raise ValueError("The summary is out of date.")
+        summary = {
+            int(course): [
+                (user, CourseTime(centiseconds), advanced)
+                for user, centiseconds, advanced in places
+            ]
+            for course, places in data["courses"].items()
+        }
+    except (OSError, ValueError, KeyError, TypeError):
+        month = open_archive(file)
+        summary = {
+            course: month.leaderboard(course, SUMMARY_SIZE) for course in month.rankings
+        }
+        data = {
+            "signature": signature,
+            "courses": {
+                course: [
+                    (user, time.centiseconds, advanced)
+                    for user, time, advanced in places
+                ]
+                for course, places in summary.items()
+            },
+        }
+        temporary = summary_file.with_name(f"{SUMMARY_NAME}.tmp")
+        try:
+            temporary.write_text(json.dumps(data))
+            os.replace(temporary, summary_file)
+        except OSError:
+            logger.exception(f"Could not write the summary of {file}.")
+    _summaries[file] = (signature, summary)
+    return summary
+
+
+def merge_places(streams: Iterable[Iterable[Place]], limit: int) -> list[Place]:
+    """Merge leaderboards into one, keeping each user's best time.
+
+    Each stream must be sorted fastest first. They are merged lazily, so only
+    as many places are read as it takes to find `limit` different users.
+
+    Args:
+        streams (Iterable[Iterable[Place]]): The leaderboards.
+        limit (int): The number of places.
+
+    Returns:
+        list[Place]: The user ID, time and advanced flag of each place, fastest first.
+    """
+    places: list[Place] = []
+    seen: set[int] = set()
+    for user, time, advanced in heapq.merge(
+        *streams, key=lambda place: (place[1], place[0])
+    ):
+        if user in seen:
+            # a faster time of theirs was already merged
+            continue
+        seen.add(user)
+        places.append((user, time, advanced))
+        if len(places) == limit:
+            break
+    return places
+
+
+def merged_leaderboard(
+    root: Path,
+    course: int,
+    limit: int,
+    first: Optional[tuple[int, int]] = None,
+    last: Optional[tuple[int, int]] = None,
+    current: Optional[list[Place]] = None,
+) -> list[Place]:
+    """Get the fastest users on a course over a range of months.
+
+    Every user's place comes from the month of their best time, and a user in
+    the top `limit` overall is always in the top `limit` of that month, so only
+    the top of each month is merged. This reads files, so on the event loop run
+    it in a thread.
+
+    Args:
+        root (Path): The folder `database_archive` is in.
+        course (int): The course.
+        limit (int): The number of places.
+        first (tuple[int, int], optional): The first year and month to include. Defaults to the oldest.
+        last (tuple[int, int], optional): The last year and month to include. Defaults to the newest.
+        current (list[Place], optional): The current month's top `limit` places, used instead of its backup. Take them from the database on the event loop, where its rankings change. Defaults to None.
+
+    Returns:
+        list[Place]: The user ID, time and advanced flag of each place, fastest first.
+    """
+
+    def included(month: tuple[int, int]) -> bool:
+        return (first is None or month >= first) and (last is None or month <= last)
+
+    streams = []
+    live = leaderboard_month() if current is not None else None
+    if current is not None and included(live):  # type: ignore
+        streams.append(current)
+    for year, month, file in archived_months(root):
+        if (year, month) != live and included((year, month)):
+            streams.append(month_top(file, course, limit))
+    return merge_places(streams, limit)
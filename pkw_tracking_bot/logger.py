@@ -1,17 +1,43 @@
 # SPDX-FileCopyrightText: 2023 osfanbuff63
 #
 # SPDX-License-Identifier: Apache-2.0
-"""Logger initialization."""
+"""Logger initialization.
 
+Records are put on a queue and written to `pkw_tracking_bot.log` by a
+background thread, so logging never blocks the event loop on disk I/O. The
+file is rotated once it reaches `LOG_MAX_BYTES`, keeping `LOG_BACKUPS` old
+files, and only records at `LOG_LEVEL` or above are logged.
+"""
+
+import atexit
 import logging
+import logging.handlers
+import queue
+
+from . import _constants
 
-from pathlib import Path
+level = logging.getLevelName(str(getattr(_constants, "LOG_LEVEL", "INFO")).upper())
+if not isinstance(level, int):
+    raise ValueError(f"Unknown LOG_LEVEL: {level}")
 
-file = Path("pkw_tracking_bot.log")
-file.write_text("")
-handler = logging.FileHandler(
-    filename="pkw_tracking_bot.log", encoding="utf-8", mode="w"
+# the file is only opened when the first record is written, so importing does no I/O
+file_handler = logging.handlers.RotatingFileHandler(
+    filename="pkw_tracking_bot.log",
+    encoding="utf-8",
+    maxBytes=getattr(_constants, "LOG_MAX_BYTES", 5 * 1024 * 1024),
+    backupCount=getattr(_constants, "LOG_BACKUPS", 3),
+    delay=True,
 )
+_queue: queue.SimpleQueue = queue.SimpleQueue()
+# what the loggers write to, formatting happens here and writing in the listener's thread
+handler = logging.handlers.QueueHandler(_queue)
+listener = logging.handlers.QueueListener(_queue, file_handler)
+listener.start()
+# write out whatever is still queued on exit
+atexit.register(listener.stop)
+
 logger = logging.getLogger("pkw_tracking_bot")
 logger.addHandler(handler)
-logger.setLevel(logging.DEBUG)
+logger.setLevel(level)
+# the handler is also put on the root logger when the bot runs, don't write records twice
+logger.propagate = False
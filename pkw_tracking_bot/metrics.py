@@ -0,0 +1,185 @@
+# SPDX-FileCopyrightText: 2023 osfanbuff63
+#
+# SPDX-License-Identifier: Apache-2.0
+"""Latency and I/O metrics, shown by /metrics and written in Prometheus' text format."""
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from pathlib import Path
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)  # fmt: skip
+
+# what each metric measures, for the Prometheus output
+HELP = {
+    "pkw_command_seconds": "Time from an app command reaching the bot to it finishing.",
+    "pkw_button_seconds": "Time to handle a leaderboard button press.",
+    "pkw_database_seconds": "Time spent in database operations.",
+    "pkw_bytes_written_total": "Bytes written to the database, its journal and backups.",
+}
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    """The number of observations in each bucket, with their count and sum, like a Prometheus histogram."""
+
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self) -> None:
+        """Initialize an empty histogram."""
+        # per bucket, not cumulative; the last one is +Inf
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Count an observation."""
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket it falls in.
+
+        Args:
+            q (float): The quantile, between 0 and 1.
+
+        Returns:
+            float: The estimate, which is infinite if it is past the last bucket.
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """Histograms of durations and counters, keyed by name and labels.
+
+    Anything can record from any thread, the event loop and the writer thread
+    both do.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty set of metrics."""
+        self._lock = threading.Lock()
+        self.histograms: dict[str, dict[Labels, Histogram]] = {}
+        self.counters: dict[str, dict[Labels, float]] = {}
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Record a duration in a histogram.
+
+        Args:
+            name (str): The metric, like `pkw_command_seconds`.
+            value (float): The duration, in seconds.
+            **labels (str): The labels, like `command="submit"`.
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.histograms.setdefault(name, {}).setdefault(key, Histogram()).observe(
+                value
+            )
+
+    def increment(self, name: str, amount: float = 1, **labels: str) -> None:
+        """Add to a counter.
+
+        Args:
+            name (str): The metric, like `pkw_bytes_written_total`.
+            amount (float, optional): The amount to add. Defaults to 1.
+            **labels (str): The labels.
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counter = self.counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0) + amount
+
+    @contextmanager
+    def timed(self, name: str, **labels: str) -> Iterator[None]:
+        """Record how long the body of a `with` block takes, even if it raises.
+
+        Args:
+            name (str): The metric.
+            **labels (str): The labels.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(
+        self,
+    ) -> tuple[dict[str, dict[Labels, Histogram]], dict[str, dict[Labels, float]]]:
+        """Copy the histograms and counters, so they can be read while recording goes on."""
+        with self._lock:
+            histograms = {}
+            for name, series in self.histograms.items():
+                histograms[name] = {}
+                for key, histogram in series.items():
+                    copy = Histogram()
+                    copy.counts = histogram.counts.copy()
+                    copy.count, copy.sum = histogram.count, histogram.sum
+                    histograms[name][key] = copy
+            counters = {name: dict(series) for name, series in self.counters.items()}
+        return histograms, counters
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        histograms, counters = self.snapshot()
+        lines = []
+        for name, series in sorted(histograms.items()):
+            lines += _header(name, "histogram")
+            for key, histogram in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip((*BUCKETS, "+Inf"), histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        f"{name}_bucket{_labels(key + (('le', str(bound)),))} {cumulative}"
+                    )
+                lines.append(f"{name}_sum{_labels(key)} {histogram.sum}")
+                lines.append(f"{name}_count{_labels(key)} {histogram.count}")
+        for name, series in sorted(counters.items()):
+            lines += _header(name, "counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, file: Path) -> None:
+        """Atomically write every metric to a file for node-exporter's textfile collector.
+
+        Args:
+            file (Path): The file, which the collector only reads if it ends in `.prom`.
+        """
+        temporary = file.with_name(f"{file.name}.tmp")
+        temporary.write_text(self.render(), encoding="utf-8")
+        os.replace(temporary, file)
+
+
+def _header(name: str, kind: str) -> list[str]:
+    lines = [f"# HELP {name} {HELP[name]}"] if name in HELP else []
+    return lines + [f"# TYPE {name} {kind}"]
+
+
+def _labels(key: Labels) -> str:
+    if not key:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in key
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+metrics = Metrics()
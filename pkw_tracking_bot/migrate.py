@@ -0,0 +1,135 @@
+# SPDX-FileCopyrightText: 2023 osfanbuff63
+#
+# SPDX-License-Identifier: Apache-2.0
+"""Migrate a TOML database and its archive to SQLite."""
+
+import argparse
+import tomllib
+
+import arrow
+
+from .logger import logger
+from .records import COURSES, Records
+from .storage import JournalBackend, SqliteBackend
+from .times import leaderboard_month
+from pathlib import Path
+
+
+def _import_month(
+    backend: SqliteBackend, year: int, month: int, records: Records
+) -> int:
+    connection = backend.connection
+    connection.execute(
+        "INSERT INTO months (year, month, last_updated) VALUES (?, ?, ?) "
+        "ON CONFLICT (year, month) DO UPDATE SET last_updated = excluded.last_updated",
+        (year, month, records.last_updated),
+    )
+    month_id = connection.execute(
+        "SELECT id FROM months WHERE year = ? AND month = ?", (year, month)
+    ).fetchone()[0]
+    # importing a month again replaces it
+    connection.execute("DELETE FROM users WHERE month_id = ?", (month_id,))
+    connection.execute("DELETE FROM times WHERE month_id = ?", (month_id,))
+    connection.executemany(
+        "INSERT OR IGNORE INTO users (month_id, user_id) VALUES (?, ?)",
+        [(month_id, user) for user in records.users],
+    )
+    for course in COURSES:
+        connection.executemany(
+            "INSERT OR REPLACE INTO times (month_id, user_id, course, time, advanced) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (month_id, user, course, time.centiseconds, int(advanced))
+                for user, time, advanced in records.entries(course)
+            ],
+        )
+    return month_id
+
+
+def migrate(source: Path, destination: Path) -> None:
+    """Copy a TOML database and its `database_archive/YYYY/M/` tree into SQLite.
+
+    Args:
+        source (Path): The TOML database, usually `database.toml`.
+        destination (Path): The SQLite database to create.
+
+    Raises:
+        FileNotFoundError: If `source` does not exist.
+        FileExistsError: If `destination` already exists.
+    """
+    if not source.exists():
+        raise FileNotFoundError(f"{source} does not exist, not migrating.")
+    if destination.exists():
+        raise FileExistsError(f"{destination} already exists, not migrating.")
+    backend = SqliteBackend(destination)
+    try:
+        _migrate(source, backend)
+    except BaseException:
+        # don't leave a partial database behind, it would stop the next attempt
+        backend.connection.close()
+        for file in (
+            destination,
+            destination.with_name(f"{destination.name}-wal"),
+            destination.with_name(f"{destination.name}-shm"),
+        ):
+            file.unlink(missing_ok=True)
+        raise
+    backend.connection.close()
+
+
+def _migrate(source: Path, backend: SqliteBackend) -> None:
+    with backend.connection:
+        for archive in sorted(source.parent.glob("database_archive/*/*/database.toml")):
+            year, month = int(archive.parent.parent.name), int(archive.parent.name)
+            logger.info(f"Migrating archive for {year}/{month}.")
+            with archive.open("rb") as _file:
+                records = Records.from_document(tomllib.load(_file))
+            _import_month(backend, year, month, records)
+        # replays the journal too
+        current = JournalBackend(source).load()
+        last_updated = current.last_updated
+        year, month = leaderboard_month(
+            arrow.get(last_updated) if last_updated is not None else None
+        )
+        # the live database wins over the archive copy of the same month
+        month_id = _import_month(backend, year, month, current)
+        backend.connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('current_month', ?)",
+            (month_id,),
+        )
+
+
+def repair(source: Path) -> None:
+    """Rewrite a TOML database with its registered users deduplicated.
+
+    The journal is replayed and compacted as well. See `Records.from_document`
+    for what is repaired.
+
+    Args:
+        source (Path): The TOML database, usually `database.toml`.
+    """
+    backend = JournalBackend(source)
+    backend.compact(backend.load().dumps())
+
+
+def run() -> None:
+    """Run the migrator from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("source", nargs="?", default="database.toml", type=Path)
+    parser.add_argument("destination", nargs="?", default="database.sqlite3", type=Path)
+    parser.add_argument(
+        "--repair",
+        action="store_true",
+        help="repair the registered users of the TOML database in place instead of migrating it",
+    )
+    args = parser.parse_args()
+    if args.repair:
+        repair(args.source)
+        print(f"Repaired {args.source}.")
+        return
+    migrate(args.source, args.destination)
+    print(f"Migrated {args.source} to {args.destination}.")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,151 @@
+# SPDX-FileCopyrightText: 2023 osfanbuff63
+#
+# SPDX-License-Identifier: Apache-2.0
+"""The asynchronous persistence layer."""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from .exceptions import TimeException
+
+from .logger import logger
+
+
+class PersistenceWriter:
+    """A single writer task that runs database flushes on a background thread.
+
+    Commands mutate the in-memory database on the event loop and then await
+    `submit`, so serializing and writing the file never blocks the gateway.
+    Jobs are run one at a time, in the order they were submitted.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the writer. The task itself is started on first use."""
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="pkw-writer"
+        )
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the writer task on the running event loop, if it isn't already."""
+        if self._task is None or self._task.done():
+            # a queue is bound to the loop it is first used on, and this may be a new one
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(
+                self._run(), name="pkw-writer"
+            )
+
+    async def submit(self, job: Callable[..., Any], *args: Any) -> Any:
+        """Queue a job for the writer thread and wait for it to finish.
+
+        Args:
+            job (Callable): The blocking function to run.
+            *args: The arguments to pass to `job`.
+
+        Returns:
+            Any: Whatever `job` returned. Exceptions raised by `job` are re-raised here.
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((job, args, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job, args, future = await self._queue.get()
+            try:
+                result = await loop.run_in_executor(self._executor, job, *args)
+            except Exception as e:
+                logger.exception("Persistence job failed.")
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self._queue.task_done()
+
+    async def close(self) -> None:
+        """Wait for all queued jobs to finish, then stop the writer."""
+        if self._task is not None and not self._task.done():
+            await self._queue.join()
+            self._task.cancel()
+        self._task = None
+        self._executor.shutdown(wait=True)
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="pkw-writer"
+        )
+
+
+writer = PersistenceWriter()
+
+# seconds a group commit waits for more submissions before writing
+COMMIT_WINDOW = 0.02
+
+
+class GroupCommit:
+    """Batches the times submitted to a database into shared commits.
+
+    The first submission of a batch waits `window` seconds (and for the previous
+    batch to finish committing) for others to join it. Then the whole batch is
+    applied in order with `Database.write_many` and persisted by one flush, so it
+    is serialized, synced and backed up once. Each submitter gets its own result.
+    """
+
+    def __init__(self, database: Any, window: float = COMMIT_WINDOW) -> None:
+        """Initialize the group commit.
+
+        Args:
+            database (Database): The database to write to.
+            window (float, optional): The number of seconds to wait for more submissions. Defaults to 0.02.
+        """
+        self.database = database
+        self.window = window
+        # held while a batch is being committed, the next batch gathers meanwhile
+        self._lock = asyncio.Lock()
+        self._batch: list[tuple[tuple, asyncio.Future]] = []
+        # the event loop only keeps weak references to tasks
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, entry: tuple) -> Optional[TimeException]:
+        """Submit a time and wait for the commit it is part of.
+
+        Args:
+            entry (tuple): The user ID, time, course and advanced flag, as taken by `Database.write_many`.
+
+        Returns:
+            Optional[TimeException]: None if the time was written, or the exception if it was slower than the stored time.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._batch.append((entry, future))
+        if len(self._batch) == 1:
+            task = asyncio.create_task(self._commit(), name="pkw-group-commit")
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return await future
+
+    async def _commit(self) -> None:
+        async with self._lock:
+            await asyncio.sleep(self.window)
+            batch, self._batch = self._batch, []
+            try:
+                results = self.database.write_many([entry for entry, _ in batch])
+                await self.database.flush()
+            except Exception as e:
+                logger.exception("Group commit failed.")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            logger.debug("Committed %d submissions together.", len(batch))
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if result is None or isinstance(result, TimeException):
+                    future.set_result(result)
+                else:
+                    # only this submission failed, the rest of the batch was committed
+                    future.set_exception(result)
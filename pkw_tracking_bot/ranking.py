@@ -0,0 +1,109 @@
+# SPDX-FileCopyrightText: 2023 osfanbuff63
+#
+# SPDX-License-Identifier: Apache-2.0
+"""The per-course ranking index."""
+
+from bisect import bisect_left, insort
+from typing import Optional
+
+from .records import COURSES, Records
+from .times import CourseTime
+
+
+class CourseRanking:
+    """The users with a time on one course, kept sorted from fastest to slowest.
+
+    Lookups are binary searches over a sorted list, so finding a user's rank is
+    logarithmic and the top places are a slice. Users with the same time are
+    ordered by user ID.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty ranking."""
+        # (centiseconds, user ID), sorted
+        self._order: list[tuple[int, int]] = []
+        self._times: dict[int, tuple[CourseTime, bool]] = {}
+
+    def __len__(self) -> int:
+        """The number of users with a time."""
+        return len(self._order)
+
+    def __contains__(self, user: int) -> bool:
+        """Whether a user has a time."""
+        return user in self._times
+
+    def update(self, user: int, time: CourseTime, advanced: bool = False) -> None:
+        """Set a user's time, replacing the one they had.
+
+        Args:
+            user (int): The user's ID.
+            time (CourseTime): Their time.
+            advanced (bool, optional): Whether it was an advanced completion. Defaults to False.
+        """
+        self.remove(user)
+        insort(self._order, (time.centiseconds, user))
+        self._times[user] = (time, advanced)
+
+    def remove(self, user: int) -> None:
+        """Remove a user's time, if they have one.
+
+        Args:
+            user (int): The user's ID.
+        """
+        entry = self._times.pop(user, None)
+        if entry is not None:
+            del self._order[bisect_left(self._order, (entry[0].centiseconds, user))]
+
+    def clear(self) -> None:
+        """Remove every time."""
+        self._order.clear()
+        self._times.clear()
+
+    def get(self, user: int) -> Optional[tuple[CourseTime, bool]]:
+        """Get a user's time and whether it was an advanced completion."""
+        return self._times.get(user)
+
+    def rank(self, user: int) -> Optional[int]:
+        """Get a user's place, starting at 1.
+
+        Args:
+            user (int): The user's ID.
+
+        Returns:
+            Optional[int]: The place, or None if the user has no time.
+        """
+        entry = self._times.get(user)
+        if entry is None:
+            return None
+        return bisect_left(self._order, (entry[0].centiseconds, user)) + 1
+
+    def top(
+        self, limit: Optional[int] = None, start: int = 0
+    ) -> list[tuple[int, CourseTime, bool]]:
+        """Get the fastest times in order.
+
+        Args:
+            limit (int, optional): The number of places to return. Defaults to all of them.
+            start (int, optional): The number of places to skip. Defaults to 0.
+
+        Returns:
+            list[tuple[int, CourseTime, bool]]: The user ID, time and advanced flag of each place.
+        """
+        stop = None if limit is None else start + limit
+        return [(user, *self._times[user]) for _, user in self._order[start:stop]]
+
+
+def build_rankings(records: Records) -> dict[int, CourseRanking]:
+    """Build the ranking of every course from the in-memory records.
+
+    Args:
+        records (Records): The month.
+
+    Returns:
+        dict[int, CourseRanking]: The ranking of each course, by course number.
+    """
+    rankings = {course: CourseRanking() for course in COURSES}
+    for course, ranking in rankings.items():
+        for user, time, advanced in records.entries(course):
+            ranking.update(user, time, advanced)
+    return rankings
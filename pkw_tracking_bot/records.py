@@ -0,0 +1,209 @@
+# SPDX-FileCopyrightText: 2023 osfanbuff63
+#
+# SPDX-License-Identifier: Apache-2.0
+"""The compact in-memory form of a month's times."""
+
+from array import array
+from typing import Any, Iterator, Mapping, Optional
+
+from .logger import logger
+from .times import CourseTime
+
+COURSES = range(1, 8)
+
+
+class Records:
+    """Every registered user's course times, kept in flat arrays.
+
+    A user's slot is their position in `users`, and course `c` of slot `s` is at
+    index `s * 7 + c - 1` of `times` (in centiseconds, 0 for no time) and of
+    `advanced`. This takes a few dozen bytes per user, where a TOML document
+    keeps a formatted node per key. Months are read with `tomllib` and written
+    by `dumps`, so tomlkit documents are never built.
+    """
+
+    __slots__ = ("users", "index", "times", "advanced", "last_updated")
+
+    def __init__(self) -> None:
+        """Initialize an empty month."""
+        # user IDs, in the order they registered
+        self.users: list[int] = []
+        # user ID -> slot
+        self.index: dict[int, int] = {}
+        self.times = array("i")
+        self.advanced = bytearray()
+        self.last_updated: Optional[int] = None
+
+    def __len__(self) -> int:
+        """The number of registered users."""
+        return len(self.users)
+
+    def __contains__(self, user: object) -> bool:
+        """Whether a user is registered."""
+        return user in self.index
+
+    @classmethod
+    def from_document(cls, document: Mapping) -> "Records":
+        """Read a month laid out like `database.toml`.
+
+        Older versions of the bot could list a user in `registered_users` more
+        than once, or write a user's table without listing them. Duplicates are
+        dropped and unlisted users are registered after the listed ones, so the
+        next save writes the repaired month.
+
+        Args:
+            document (Mapping): The month, as a TOML document or a plain dict.
+
+        Returns:
+            Records: The month.
+        """
+        records = cls()
+        records.last_updated = document.get("last_updated")
+        listed = document.get("registered_users", [])
+        duplicates = len(listed) - len(records.add_users(listed))
+        unlisted = records.add_users(
+            [
+                key
+                for key, value in document.items()
+                if key.isdigit() and isinstance(value, Mapping)
+            ]
+        )
+        if duplicates or unlisted:
+            logger.warning(
+                f"Repaired the registered users: dropped {duplicates} duplicates, registered {len(unlisted)} unlisted users."
+            )
+        for slot, user in enumerate(records.users):
+            stats = document.get(str(user), {})
+            for course in COURSES:
+                course_stats = stats.get(f"course_{course}", {})
+                time = CourseTime.from_stored(course_stats.get("time"))
+                if time is not None:
+                    records.times[slot * 7 + course - 1] = time.centiseconds
+                if course_stats.get("advanced", False):
+                    records.advanced[slot * 7 + course - 1] = 1
+        return records
+
+    def dumps(self) -> str:
+        """Serialize the month as `database.toml`, exactly as tomlkit did (see `tests/test_records.py`)."""
+        lines = []
+        if self.last_updated is not None:
+            lines.append(f"last_updated = {self.last_updated}")
+        if self.users:
+            lines.append(f"registered_users = [{', '.join(map(str, self.users))}]")
+        for slot, user in enumerate(self.users):
+            lines.append(f"\n[{user}]")
+            for course in COURSES:
+                index = slot * 7 + course - 1
+                lines.append(
+                    f"course_{course}.advanced = {'true' if self.advanced[index] else 'false'}"
+                )
+                if self.times[index]:
+                    lines.append(f"course_{course}.time = {self.times[index]}")
+        return "\n".join(lines)
+
+    def copy(self) -> "Records":
+        """Copy the month, so it can be serialized while this one keeps changing."""
+        records = Records()
+        records.users = self.users.copy()
+        records.index = self.index.copy()
+        records.times = array("i", self.times)
+        records.advanced = bytearray(self.advanced)
+        records.last_updated = self.last_updated
+        return records
+
+    def add_users(self, user_ids: list) -> list[int]:
+        """Register users, skipping any that already are.
+
+        Registering is idempotent, and checking a user is a dict lookup, so
+        registering `n` users takes `O(n)` however many are registered.
+
+        Args:
+            user_ids (list): The user IDs.
+
+        Returns:
+            list[int]: The IDs that weren't registered before, in order and without duplicates.
+        """
+        new_users = []
+        for user_id in user_ids:
+            user_id = int(user_id)
+            if user_id in self.index:
+                continue
+            self.index[user_id] = len(self.users)
+            self.users.append(user_id)
+            new_users.append(user_id)
+        if new_users:
+            self.times.extend([0] * 7 * len(new_users))
+            self.advanced.extend(bytes(7 * len(new_users)))
+        return new_users
+
+    def get(self, user: int, course: int) -> Optional[tuple[CourseTime, bool]]:
+        """Get a user's time on a course and whether it was an advanced completion.
+
+        Args:
+            user (int): The user's ID.
+            course (int): The course.
+
+        Returns:
+            Optional[tuple[CourseTime, bool]]: The time and advanced flag, or None if the user has no time.
+        """
+        slot = self.index.get(user)
+        if slot is None or not self.times[slot * 7 + course - 1]:
+            return None
+        return (
+            CourseTime(self.times[slot * 7 + course - 1]),
+            bool(self.advanced[slot * 7 + course - 1]),
+        )
+
+    def set(self, user: int, course: int, time: CourseTime, advanced: bool) -> None:
+        """Set a user's time on a course, registering them if needed.
+
+        Args:
+            user (int): The user's ID.
+            course (int): The course.
+            time (CourseTime): The time.
+            advanced (bool): Whether it was an advanced completion.
+        """
+        self.add_users([user])
+        slot = self.index[user]
+        self.times[slot * 7 + course - 1] = time.centiseconds
+        self.advanced[slot * 7 + course - 1] = advanced
+
+    def entries(self, course: int) -> Iterator[tuple[int, CourseTime, bool]]:
+        """Iterate over the users with a time on a course.
+
+        Args:
+            course (int): The course.
+
+        Yields:
+            tuple[int, CourseTime, bool]: The user ID, time and advanced flag.
+        """
+        for slot, user in enumerate(self.users):
+            time = self.times[slot * 7 + course - 1]
+            if time:
+                yield user, CourseTime(time), bool(self.advanced[slot * 7 + course - 1])
+
+    def __getitem__(self, key: str) -> Any:
+        """Get a key as it is laid out in `database.toml`.
+
+        Args:
+            key (str): `last_updated`, `registered_users` or a user ID.
+
+        Raises:
+            KeyError: If the key does not exist.
+        """
+        if key == "last_updated" and self.last_updated is not None:
+            return self.last_updated
+        if key == "registered_users" and self.users:
+            return list(self.users)
+        if key.isdigit() and int(key) in self.index:
+            slot = self.index[int(key)]
+            stats: dict[str, dict] = {}
+            for course in COURSES:
+                course_stats: dict[str, Any] = {
+                    "advanced": bool(self.advanced[slot * 7 + course - 1])
+                }
+                if self.times[slot * 7 + course - 1]:
+                    course_stats["time"] = self.times[slot * 7 + course - 1]
+                stats[f"course_{course}"] = course_stats
+            return stats
+        raise KeyError(key)
@@ -0,0 +1,433 @@
+# SPDX-FileCopyrightText: 2023 osfanbuff63
+#
+# SPDX-License-Identifier: Apache-2.0
+"""The storage backends behind the database."""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import tomllib
+from typing import Any, Optional
+
+import arrow
+
+from .logger import logger
+from .metrics import metrics
+from .records import Records
+from .times import CourseTime, leaderboard_month
+from pathlib import Path
+
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+
+
+class StorageBackend:
+    """The interface every storage backend implements.
+
+    The database keeps its state in memory as `Records` and records every change
+    it makes as a tuple:
+
+    - `("time", user_id, course_id, time, advanced, timestamp)`
+    - `("register", [user_id, ...], timestamp)`
+    - `("reset", timestamp)`
+
+    `snapshot` is called with the database lock held and `commit` is called on
+    the writer thread without it, so backends should do as little as possible in
+    `snapshot`.
+    """
+
+    def load(self) -> Records:
+        """Load the stored database."""
+        raise NotImplementedError
+
+    def snapshot(self, records: Records, changes: list[tuple]) -> Any:
+        """Capture what `commit` needs to persist the pending changes.
+
+        Args:
+            records (Records): The in-memory database.
+            changes (list[tuple]): The changes made since the last commit.
+        """
+        raise NotImplementedError
+
+    def commit(self, snapshot: Any) -> Optional[str]:
+        """Persist a snapshot.
+
+        Args:
+            snapshot (Any): The value returned by `snapshot`.
+
+        Returns:
+            Optional[str]: The serialized document if one was produced, so it can be reused for the backup.
+        """
+        raise NotImplementedError
+
+    def due(self) -> bool:
+        """Whether a commit is needed even though nothing changed."""
+        return False
+
+    def close(self) -> None:
+        """Release the resources held by the backend, once it is no longer used."""
+
+    def signature(self) -> object:
+        """Something that changes whenever the stored database is changed.
+
+        The database compares it with the value from its own last load or commit
+        to notice changes made by something else.
+        """
+        return None
+
+
+class TomlBackend(StorageBackend):
+    """Stores the whole database in a single TOML file."""
+
+    def __init__(self, file: Path) -> None:
+        """Initialize the TOML backend.
+
+        Args:
+            file (Path): The path to the TOML file.
+        """
+        self.file = file
+        if self.file.exists() is False:
+            self.file.write_text("")
+
+    def load(self) -> Records:
+        """Load the database."""
+        with self.file.resolve().open("rb") as _file:
+            return Records.from_document(tomllib.load(_file))
+
+    def snapshot(self, records: Records, changes: list[tuple]) -> Records:
+        """Copy the whole database, as the file is rewritten in full."""
+        return records.copy()
+
+    def commit(self, snapshot: Records) -> str:
+        """Serialize the copy and write it to the file."""
+        with metrics.timed("pkw_database_seconds", operation="serialize"):
+            text = snapshot.dumps()
+        metrics.increment(
+            "pkw_bytes_written_total", self.file.write_text(text), file="database"
+        )
+        return text
+
+    def signature(self) -> object:
+        """The modification time and size of the file."""
+        return _stat_signature(self.file)
+
+
+def _stat_signature(file: Path) -> Optional[tuple[int, int]]:
+    try:
+        stat = file.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def apply_change(records: Records, change: tuple) -> Records:
+    """Apply a recorded change to a month, as the database did when it was made.
+
+    Applying a change twice has the same result as applying it once, so a journal
+    can be replayed over a snapshot that already contains some of it.
+
+    Args:
+        records (Records): The month to change.
+        change (tuple): The change, in the format described by `StorageBackend`.
+
+    Returns:
+        Records: The changed month, which is a new one after a reset.
+    """
+    match change:
+        case ("time", user_id, course_id, time, advanced, timestamp):
+            records.set(user_id, course_id, CourseTime(time), advanced)
+        case ("register", user_ids, timestamp):
+            records.add_users(user_ids)
+        case ("reset", timestamp):
+            if (records.last_updated or 0) >= timestamp:
+                # the snapshot was taken after this reset
+                return records
+            records = Records()
+        case _:
+            logger.error(f"Unknown database change: {change}")
+            return records
+    records.last_updated = timestamp
+    return records
+
+
+class JournalBackend(TomlBackend):
+    """Appends every change to a journal and only occasionally rewrites the TOML file.
+
+    Each commit appends one line per change to `<name>.journal` next to the
+    database, which costs the same no matter how big the database is. Once
+    `compact_every` entries have built up, or `compact_interval` seconds have
+    passed, the whole document is written to the TOML file (the snapshot) and the
+    journal is emptied. Loading replays the journal over the snapshot, so nothing
+    written to the journal is lost if the bot stops before compacting.
+    """
+
+    def __init__(
+        self, file: Path, compact_every: int = 100, compact_interval: float = 300
+    ) -> None:
+        """Initialize the journal backend.
+
+        Args:
+            file (Path): The path to the TOML snapshot.
+            compact_every (int, optional): Compact after this many journal entries. Defaults to 100.
+            compact_interval (float, optional): Compact when entries are this many seconds old. Defaults to 300.
+        """
+        super().__init__(file)
+        self.journal = file.with_name(f"{file.stem}.journal")
+        self.compact_every = compact_every
+        self.compact_interval = compact_interval
+        self._entries = 0
+        self._last_compaction = time.monotonic()
+
+    def load(self) -> Records:
+        """Load the snapshot and replay the journal over it.
+
+        A last line cut off mid-write is removed from the journal, so the next
+        append starts on a line of its own.
+        """
+        records = super().load()
+        self._entries = 0
+        if self.journal.exists():
+            data = self.journal.read_bytes()
+            complete = data.rfind(b"\n") + 1
+            if complete < len(data):
+                # the bot stopped mid-append, everything before that line is intact
+                logger.warning("Dropping incomplete journal entry: %r", data[complete:])
+                with self.journal.open("r+b") as journal:
+                    journal.truncate(complete)
+                    journal.flush()
+                    os.fsync(journal.fileno())
+            for line in data[:complete].decode("utf-8").splitlines():
+                try:
+                    change = tuple(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning("Skipping unreadable journal entry: %r", line)
+                    continue
+                records = apply_change(records, change)
+                self._entries += 1
+        if self._entries:
+            logger.info(f"Replayed {self._entries} journal entries.")
+        return records
+
+    def signature(self) -> object:
+        """The modification times and sizes of the snapshot and the journal."""
+        return _stat_signature(self.file), _stat_signature(self.journal)
+
+    def due(self) -> bool:
+        """Whether the journal has entries that are old enough to compact."""
+        return (
+            self._entries > 0
+            and time.monotonic() - self._last_compaction >= self.compact_interval
+        )
+
+    def snapshot(
+        self, records: Records, changes: list[tuple]
+    ) -> tuple[list[tuple], Optional[Records]]:
+        """Capture the changes, plus a copy of the whole database if it is time to compact."""
+        if self._entries + len(changes) >= self.compact_every or self.due():
+            return changes, records.copy()
+        return changes, None
+
+    def commit(self, snapshot: tuple[list[tuple], Optional[Records]]) -> Optional[str]:
+        """Append the changes to the journal, compacting it if needed."""
+        changes, records = snapshot
+        if records is not None:
+            with metrics.timed("pkw_database_seconds", operation="serialize"):
+                text = records.dumps()
+            self.compact(text)
+            return text
+        if changes:
+            lines = "".join(json.dumps(change) + "\n" for change in changes)
+            with self.journal.open("a", encoding="utf-8") as journal:
+                journal.write(lines)
+                journal.flush()
+                os.fsync(journal.fileno())
+            self._entries += len(changes)
+            metrics.increment("pkw_bytes_written_total", len(lines), file="journal")
+        return None
+
+    def compact(self, text: str) -> None:
+        """Replace the snapshot with `text` and empty the journal.
+
+        Args:
+            text (str): The serialized document, including every journaled change.
+        """
+        temporary = self.file.with_name(f"{self.file.name}.tmp")
+        with temporary.open("w", encoding="utf-8") as snapshot:
+            metrics.increment(
+                "pkw_bytes_written_total", snapshot.write(text), file="database"
+            )
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temporary, self.file)
+        # if the bot stops here, replaying the old journal over the new snapshot is harmless
+        self.journal.write_text("")
+        self._entries = 0
+        self._last_compaction = time.monotonic()
+        logger.debug("Compacted the journal into the snapshot.")
+
+
+class SqliteBackend(StorageBackend):
+    """Stores the database in SQLite, with one row per user and course time.
+
+    Commits only touch the rows that changed. Every month keeps its own users and
+    times, so a reset starts a new month instead of deleting anything.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS months (
+        id INTEGER PRIMARY KEY,
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        last_updated INTEGER,
+        UNIQUE (year, month)
+    );
+    CREATE TABLE IF NOT EXISTS users (
+        month_id INTEGER NOT NULL REFERENCES months (id),
+        user_id INTEGER NOT NULL,
+        PRIMARY KEY (month_id, user_id)
+    );
+    CREATE TABLE IF NOT EXISTS times (
+        month_id INTEGER NOT NULL REFERENCES months (id),
+        user_id INTEGER NOT NULL,
+        course INTEGER NOT NULL,
+        time INTEGER NOT NULL,
+        advanced INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (month_id, user_id, course)
+    );
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value
+    );
+    """
+
+    def __init__(self, file: Path) -> None:
+        """Initialize the SQLite backend, creating the tables if needed.
+
+        Args:
+            file (Path): The path to the SQLite database.
+        """
+        self.file = file
+        # the connection is shared between the event loop (loading) and the writer thread
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(self.file, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(self.SCHEMA)
+
+    def current_month(self) -> int:
+        """Get the ID of the month new times are written to, creating it if needed."""
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = 'current_month'"
+        ).fetchone()
+        if row is not None:
+            return row[0]
+        return self._start_month(arrow.utcnow().int_timestamp)
+
+    def _start_month(self, timestamp: int) -> int:
+        year, month = leaderboard_month(arrow.get(timestamp))
+        self.connection.execute(
+            "INSERT INTO months (year, month, last_updated) VALUES (?, ?, ?) "
+            "ON CONFLICT (year, month) DO UPDATE SET last_updated = excluded.last_updated",
+            (year, month, timestamp),
+        )
+        month_id = self.connection.execute(
+            "SELECT id FROM months WHERE year = ? AND month = ?",
+            (year, month),
+        ).fetchone()[0]
+        self.connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('current_month', ?)",
+            (month_id,),
+        )
+        return month_id
+
+    def load(self) -> Records:
+        """Load the current month."""
+        with self._lock, self.connection:
+            month_id = self.current_month()
+            return self.load_month(month_id)
+
+    def load_month(self, month_id: int) -> Records:
+        """Load one month.
+
+        Args:
+            month_id (int): The ID of the month to load.
+        """
+        records = Records()
+        (records.last_updated,) = self.connection.execute(
+            "SELECT last_updated FROM months WHERE id = ?", (month_id,)
+        ).fetchone()
+        records.add_users(
+            [
+                row[0]
+                for row in self.connection.execute(
+                    "SELECT user_id FROM users WHERE month_id = ? ORDER BY rowid",
+                    (month_id,),
+                )
+            ]
+        )
+        for user, course, centiseconds, advanced in self.connection.execute(
+            "SELECT user_id, course, time, advanced FROM times WHERE month_id = ?",
+            (month_id,),
+        ):
+            records.set(user, course, CourseTime(centiseconds), bool(advanced))
+        return records
+
+    def close(self) -> None:
+        """Close the connection."""
+        with self._lock:
+            self.connection.close()
+
+    def signature(self) -> object:
+        """SQLite's data version, which changes when another connection commits."""
+        with self._lock:
+            return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def snapshot(self, records: Records, changes: list[tuple]) -> list[tuple]:
+        """Only the changes are needed, as they are applied row by row."""
+        return changes
+
+    def commit(self, snapshot: list[tuple]) -> None:
+        """Apply the changes in a single transaction."""
+        with self._lock, self.connection:
+            month_id = self.current_month()
+            for change in snapshot:
+                match change:
+                    case ("time", user_id, course_id, time, advanced, timestamp):
+                        self.connection.execute(
+                            "INSERT OR IGNORE INTO users (month_id, user_id) VALUES (?, ?)",
+                            (month_id, user_id),
+                        )
+                        self.connection.execute(
+                            "INSERT OR REPLACE INTO times (month_id, user_id, course, time, advanced) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (month_id, user_id, course_id, time, int(advanced)),
+                        )
+                    case ("register", user_ids, timestamp):
+                        self.connection.executemany(
+                            "INSERT OR IGNORE INTO users (month_id, user_id) VALUES (?, ?)",
+                            [(month_id, int(user_id)) for user_id in user_ids],
+                        )
+                    case ("reset", timestamp):
+                        month_id = self._start_month(timestamp)
+                    case _:
+                        logger.error(f"Unknown database change: {change}")
+                        continue
+                self.connection.execute(
+                    "UPDATE months SET last_updated = ? WHERE id = ?",
+                    (timestamp, month_id),
+                )
+        return None
+
+
+def backend_for(file: Path) -> StorageBackend:
+    """Pick the storage backend for a database file by its extension.
+
+    Args:
+        file (Path): The path to the database file.
+
+    Returns:
+        StorageBackend: `SqliteBackend` for `.db`/`.sqlite`/`.sqlite3` files, otherwise `JournalBackend`.
+    """
+    if file.suffix in SQLITE_SUFFIXES:
+        return SqliteBackend(file)
+    return JournalBackend(file)
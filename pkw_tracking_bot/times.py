@@ -0,0 +1,141 @@
+# SPDX-FileCopyrightText: 2023 osfanbuff63
+#
+# SPDX-License-Identifier: Apache-2.0
+"""The course time type, and the leaderboard months."""
+
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+import arrow
+
+from .exceptions import TimeException
+from .logger import logger
+
+# what older databases stored for a course without a time
+LEGACY_EMPTY_TIME = "99:99.99"
+TIME_PATTERN = re.compile(r"(?:(\d+):)?(\d{1,2})(?:\.(\d{1,2}))?")
+# what older bots stored, which could have more digits, like 1:23.456
+LEGACY_TIME_PATTERN = re.compile(r"(?:(\d+):)?(\d+)(?:\.(\d*))?")
+# the slowest time that can be stored, times are kept in signed 32-bit arrays (about 596 hours)
+MAX_CENTISECONDS = 2**31 - 1
+# the courses reset at this hour (UTC) on the first of every month
+RESET_HOUR = 10
+
+
+@dataclass(frozen=True, order=True, slots=True)
+class CourseTime:
+    """A course completion time, stored as a whole number of centiseconds.
+
+    Times compare and sort numerically, so `9:59.00` is faster than `10:00.00`.
+    """
+
+    centiseconds: int
+
+    @classmethod
+    def parse(cls, text: str) -> "CourseTime":
+        """Parse a time typed by a user, like `1:23.45`, `1:23.4`, `1:23` or `23.45`.
+
+        Args:
+            text (str): The time to parse.
+
+        Raises:
+            TimeException: If the text is not a valid time, or too slow to store.
+
+        Returns:
+            CourseTime: The parsed time.
+        """
+        match = TIME_PATTERN.fullmatch(text.strip())
+        if match is None:
+            raise TimeException(
+                f"{text!r} is not a valid time, it should look like 1:23.45."
+            )
+        minutes, seconds, fraction = match.groups()
+        if int(seconds) >= 60:
+            raise TimeException(f"{text!r} has more than 59 seconds.")
+        # ".5" is half a second, not five centiseconds
+        centiseconds = (
+            int(minutes or 0) * 6000
+            + int(seconds) * 100
+            + int((fraction or "0").ljust(2, "0"))
+        )
+        if centiseconds == 0:
+            raise TimeException("A time cannot be zero.")
+        if centiseconds > MAX_CENTISECONDS:
+            raise TimeException(f"{text!r} is too slow to be stored.")
+        return cls(centiseconds)
+
+    @classmethod
+    def from_stored(cls, value: object) -> Optional["CourseTime"]:
+        """Read a time from the database.
+
+        Stored times are read leniently, so one odd value doesn't stop a month
+        from loading: extra digits are truncated to centiseconds, and a value
+        that still isn't a time is logged and read as no time.
+
+        Args:
+            value (object): The stored value. This is an integer, or a string in older databases.
+
+        Returns:
+            Optional[CourseTime]: The time, or None if no time was submitted.
+        """
+        if value is None or value == LEGACY_EMPTY_TIME or value == "":
+            return None
+        if isinstance(value, str):
+            match = LEGACY_TIME_PATTERN.fullmatch(value.strip())
+            if match is None:
+                logger.warning("Ignoring unreadable stored time %r.", value)
+                return None
+            minutes, seconds, fraction = match.groups()
+            centiseconds = (
+                int(minutes or 0) * 6000
+                + int(seconds) * 100
+                + int((fraction or "0")[:2].ljust(2, "0"))
+            )
+        else:
+            try:
+                centiseconds = int(value)  # type: ignore
+            except (TypeError, ValueError):
+                logger.warning("Ignoring unreadable stored time %r.", value)
+                return None
+        if not 0 < centiseconds <= MAX_CENTISECONDS:
+            logger.warning("Ignoring out of range stored time %r.", value)
+            return None
+        return cls(centiseconds)
+
+    def __str__(self) -> str:
+        """Format the time like `1:23.45`."""
+        minutes, rest = divmod(self.centiseconds, 6000)
+        seconds, centiseconds = divmod(rest, 100)
+        return f"{minutes}:{seconds:02}.{centiseconds:02}"
+
+
+def leaderboard_month(date: Optional[arrow.Arrow] = None) -> tuple[int, int]:
+    """Get the leaderboard month a moment belongs to.
+
+    A month starts when the courses reset, so the first hours of the 1st still
+    belong to the month before.
+
+    Args:
+        date (arrow.Arrow, optional): The moment. Defaults to now.
+
+    Returns:
+        tuple[int, int]: The year and month.
+    """
+    if date is None:
+        date = arrow.utcnow()
+    shifted = date.to("UTC").shift(hours=-RESET_HOUR)
+    return shifted.year, shifted.month
+
+
+def next_reset(date: Optional[arrow.Arrow] = None) -> arrow.Arrow:
+    """Get when the courses next reset.
+
+    Args:
+        date (arrow.Arrow, optional): The moment to look from. Defaults to now.
+
+    Returns:
+        arrow.Arrow: The start of the next leaderboard month.
+    """
+    year, month = leaderboard_month(date)
+    return arrow.get(year, month, 1, RESET_HOUR).shift(months=1)
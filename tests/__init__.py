@@ -0,0 +1,4 @@
+# SPDX-FileCopyrightText: 2023 osfanbuff63
+#
+# SPDX-License-Identifier: Apache-2.0
+"""Tests for the bot, run with `python -m unittest` from the repository root."""
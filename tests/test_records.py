@@ -0,0 +1,110 @@
+# SPDX-FileCopyrightText: 2023 osfanbuff63
+#
+# SPDX-License-Identifier: Apache-2.0
+"""Check that the fast TOML paths match tomlkit.
+
+Months are read with `tomllib` and written by `Records.dumps`, both much faster
+than tomlkit, which wrote and read `database.toml` before. These check on
+generated months, including edge cases, that `dumps` writes exactly what
+tomlkit wrote, and that reading a month with `tomllib` gives the same month as
+reading it with tomlkit.
+"""
+
+import random
+import tomllib
+import unittest
+from typing import Optional
+
+import tomlkit
+
+from pkw_tracking_bot.records import COURSES, Records
+from pkw_tracking_bot.times import CourseTime
+
+
+def _month(
+    users: int, seed: int, last_updated: Optional[int] = 1_700_000_000
+) -> Records:
+    rng = random.Random(seed)
+    records = Records()
+    records.last_updated = last_updated
+    records.add_users(rng.sample(range(1, 10**18), users))
+    for user in records.users:
+        for course in COURSES:
+            roll = rng.random()
+            if roll < 0.5:
+                records.set(
+                    user, course, CourseTime(rng.randint(1, 60_000)), roll < 0.1
+                )
+            elif roll < 0.6:
+                # an advanced flag without a time
+                records.advanced[records.index[user] * 7 + course - 1] = 1
+    return records
+
+
+def _tomlkit_dumps(records: Records) -> str:
+    """Serialize a month the way the bot did with tomlkit."""
+    document = tomlkit.document()
+    if records.last_updated is not None:
+        document["last_updated"] = records.last_updated
+    if records.users:
+        document["registered_users"] = records.users
+    for slot, user in enumerate(records.users):
+        table = tomlkit.table()
+        for course in COURSES:
+            table.append(
+                tomlkit.key([f"course_{course}", "advanced"]),
+                bool(records.advanced[slot * 7 + course - 1]),
+            )
+            time = records.times[slot * 7 + course - 1]
+            if time:
+                table.append(tomlkit.key([f"course_{course}", "time"]), time)
+        document.append(str(user), table)
+    return document.as_string().rstrip()
+
+
+MONTHS = {
+    "empty": Records(),
+    "no users": _month(0, 0),
+    "never updated": _month(3, 1, last_updated=None),
+    "1 user": _month(1, 2),
+    "100 users": _month(100, 3),
+    "1000 users": _month(1_000, 4),
+}
+
+
+class TomlTest(unittest.TestCase):
+    """The fast TOML paths against tomlkit."""
+
+    def assertSameMonth(self, first: Records, second: Records) -> None:
+        """Check that two months have the same users, times, flags and last update."""
+        self.assertEqual(first.users, second.users)
+        self.assertEqual(first.times, second.times)
+        self.assertEqual(first.advanced, second.advanced)
+        self.assertEqual(first.last_updated, second.last_updated)
+
+    def test_dumps_matches_tomlkit(self) -> None:
+        """`dumps` writes exactly what tomlkit wrote."""
+        for name, records in MONTHS.items():
+            with self.subTest(name):
+                self.assertEqual(records.dumps(), _tomlkit_dumps(records))
+
+    def test_tomllib_read_matches_month(self) -> None:
+        """Reading what `dumps` wrote with `tomllib` gives the month back."""
+        for name, records in MONTHS.items():
+            with self.subTest(name):
+                read = Records.from_document(tomllib.loads(records.dumps()))
+                self.assertSameMonth(read, records)
+
+    def test_tomllib_read_matches_tomlkit_read(self) -> None:
+        """Reading a month with `tomllib` gives the same month as reading it with tomlkit."""
+        for name, records in MONTHS.items():
+            with self.subTest(name):
+                text = records.dumps()
+                self.assertSameMonth(
+                    Records.from_document(tomllib.loads(text)),
+                    Records.from_document(tomlkit.parse(text)),
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()